@@ -0,0 +1,108 @@
+"""Compare regimen consolidation with the old insert-at-a-time version.
+
+`consolidating_merge` used to insert objects one at a time, rescanning
+the collection (and dispatching `key`) for each one. It now groups them
+by key in one pass. This times both on:
+
+- long combination regimens: many doses of a handful of compounds, as
+  consolidated by the parser
+- a bulk workload: regimen parts as rebuilt from database rows, one
+  part per drug inclusion (as in `from_dao_many`)
+
+    python benchmarks/consolidate.py --doses 2000 --repeat 5
+"""
+import argparse
+import decimal
+import functools
+import random
+import timeit
+
+from shared_schema.regimens import cannonical, standard
+
+
+def insert_at_a_time(collection, newobj):
+    "The previous consolidating_insert (kept here as a baseline)"
+    matches = [
+        obj
+        for obj in collection
+        if cannonical.key(obj) == cannonical.key(newobj)
+    ]
+    others = [
+        obj
+        for obj in collection
+        if cannonical.key(obj) != cannonical.key(newobj)
+    ]
+    consolidated = functools.reduce(cannonical.add, matches, newobj)
+    return frozenset([consolidated] + others)
+
+
+def insert_at_a_time_merge(xs, ys):
+    return functools.reduce(insert_at_a_time, xs, ys)
+
+
+def long_combination(rnd, n_doses):
+    compounds = [code for _, code in standard._compounds]
+    return [
+        cannonical._dose(
+            amount=decimal.Decimal(rnd.randint(1, 400)),
+            compound=rnd.choice(compounds),
+        )
+        for _ in range(n_doses)
+    ]
+
+
+def inclusion_parts(n_copies):
+    "Regimen parts as from_dao builds them, from drug inclusion rows"
+    parts = []
+    for src in standard.regimens.values():
+        regimen = cannonical.from_string(src)
+        for incl in cannonical.drug_inclusions(regimen):
+            dose = cannonical._dose(
+                amount=incl.dose, compound=incl.medication_id
+            )
+            indication = cannonical._indication(
+                frequency=incl.frequency, doselist=frozenset([dose])
+            )
+            parts.append(
+                cannonical._regimen_part(
+                    duration=incl.duration,
+                    drug_combination=frozenset([indication]),
+                )
+            )
+    return parts * n_copies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--doses", type=int, default=2000)
+    parser.add_argument("--copies", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    rnd = random.Random(0)
+    workloads = {
+        "long combination ({} doses)".format(args.doses): long_combination(
+            rnd, args.doses
+        ),
+        "bulk regimen parts (x{})".format(args.copies): inclusion_parts(
+            args.copies
+        ),
+    }
+    for name, objs in workloads.items():
+        old = insert_at_a_time_merge(objs, [])
+        new = cannonical.consolidate(objs)
+        assert old == new, "consolidation results differ"
+        print(name)
+        for label, merge in [
+            ("insert at a time", insert_at_a_time_merge),
+            ("grouped", cannonical.consolidating_merge),
+        ]:
+            seconds = min(
+                timeit.repeat(
+                    lambda: merge(objs, []), number=1, repeat=args.repeat
+                )
+            )
+            print("  {:<20} {:8.2f} ms".format(label, seconds * 1000))
+
+
+if __name__ == "__main__":
+    main()
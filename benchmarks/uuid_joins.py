@@ -0,0 +1,135 @@
+"""Compare UUID storage on the schema's join-heavy queries.
+
+Builds two SQLite databases with the same synthetic cases, isolates,
+sequences, alignments and substitutions: one with CHAR(32) UUIDs (the
+old storage, dao.CharUUID) and one with 16-byte BLOB UUIDs (dao.UUID).
+Then it times a few queries that join along the UUID foreign keys and
+reports each database's size.
+
+    python benchmarks/uuid_joins.py --cases 2000 --repeat 5
+"""
+import argparse
+import os
+import tempfile
+import timeit
+import uuid
+
+import sqlalchemy as sa
+
+from shared_schema import dao
+
+
+def synthetic_rows(n_cases, subs_per_alignment):
+    people, cases, isolates, clinical, sequences, alignments, subs = (
+        [] for _ in range(7)
+    )
+    reference = {
+        "id": uuid.uuid4(),
+        "name": "HCV1a",
+        "genebank": "NC_004102",
+        "nt_seq": "ACGT",
+    }
+    for i in range(n_cases):
+        person = {"id": uuid.uuid4(), "sex": "other", "year_of_birth": 1950}
+        case = {"id": uuid.uuid4(), "person_id": person["id"]}
+        isolate = {"id": uuid.uuid4(), "type": "clinical"}
+        sequence = {
+            "id": uuid.uuid4(),
+            "isolate_id": isolate["id"],
+            "seq_method": "sanger",
+            "raw_nt_seq": "ACGT",
+        }
+        alignment = {
+            "id": uuid.uuid4(),
+            "sequence_id": sequence["id"],
+            "reference_id": reference["id"],
+            "nt_start": 1,
+            "nt_end": 4,
+            "gene": "NS3",
+        }
+        people.append(person)
+        cases.append(case)
+        isolates.append(isolate)
+        clinical.append({"isolate_id": isolate["id"], "case_id": case["id"]})
+        sequences.append(sequence)
+        alignments.append(alignment)
+        subs.extend(
+            {
+                "alignment_id": alignment["id"],
+                "position": p,
+                "kind": "simple",
+                "sub_aa": "A",
+            }
+            for p in range(subs_per_alignment)
+        )
+    return [
+        ("ReferenceSequence", [reference]),
+        ("Person", people),
+        ("Case", cases),
+        ("Isolate", isolates),
+        ("ClinicalIsolate", clinical),
+        ("Sequence", sequences),
+        ("Alignment", alignments),
+        ("Substitution", subs),
+    ]
+
+
+def queries(d):
+    case_subs = (
+        d.case.join(d.clinicalisolate)
+        .join(d.isolate)
+        .join(d.sequence)
+        .join(d.alignment)
+        .join(d.substitution)
+    )
+    return {
+        "substitutions per person": sa.select(
+            [d.case.c.person_id, sa.func.count()]
+        )
+        .select_from(case_subs)
+        .group_by(d.case.c.person_id),
+        "all substitutions with case": sa.select(
+            [d.case.c.id, d.substitution.c.position]
+        ).select_from(case_subs),
+        "alignments by reference": sa.select(
+            [d.referencesequence.c.name, sa.func.count()]
+        )
+        .select_from(d.alignment.join(d.referencesequence))
+        .group_by(d.referencesequence.c.name),
+    }
+
+
+def run(uuid_type, data, repeat, directory):
+    path = os.path.join(directory, "{}.db".format(uuid_type.__name__))
+    d = dao.DAO("sqlite:///{}".format(path), uuid_type=uuid_type)
+    d.init_db()
+    with d.transaction():
+        for entity, rows in data:
+            d.bulk_load(entity, rows)
+    timings = {
+        name: min(
+            timeit.repeat(lambda: list(d.query(qry)), number=1, repeat=repeat)
+        )
+        for name, qry in queries(d).items()
+    }
+    d.engine.dispose()
+    return timings, os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", type=int, default=2000)
+    parser.add_argument("--substitutions", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    data = synthetic_rows(args.cases, args.substitutions)
+    with tempfile.TemporaryDirectory() as directory:
+        for uuid_type in (dao.CharUUID, dao.UUID):
+            timings, size = run(uuid_type, data, args.repeat, directory)
+            print("{} ({:.1f} MiB)".format(uuid_type.__name__, size / 2**20))
+            for name, seconds in timings.items():
+                print("  {:<30} {:8.1f} ms".format(name, seconds * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,13 @@ install_requires = [
 
 tests_require = ["flake8 >= 3.5.0, <4.0"]
 
+# shared_schema.asyncdao needs Python 3.7+ (for contextvars and
+# contextlib.asynccontextmanager) and SQLAlchemy's asyncio extension (1.4+)
+async_require = [
+    'SQLAlchemy[asyncio] >=1.4, <2.0; python_version >= "3.7"',
+    'aiosqlite; python_version >= "3.7"',
+]
+
 setup(
     name="shared_schema",
     version="0.2",
@@ -21,6 +28,6 @@ setup(
     package_data={"shared_schema": ["templates/*.mustache"]},
     python_requires="~= 3.5",
     install_requires=install_requires,
-    extras_require={"tests": tests_require},
+    extras_require={"tests": tests_require, "async": async_require},
     test_suite="test",
 )
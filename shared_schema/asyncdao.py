@@ -0,0 +1,148 @@
+"""An asyncio version of the DAO, on SQLAlchemy's asyncio extension
+
+AsyncDAO builds the same tables as shared_schema.dao.DAO (through
+`as_table`, `column_type` and the `UUID` type), but its database
+methods are coroutines, so it doesn't block the event loop. It needs
+Python 3.7 or later (for contextvars and asynccontextmanager),
+SQLAlchemy 1.4 or later and an async database driver, e.g.:
+
+    dao = AsyncDAO("sqlite+aiosqlite:///staging.db")
+    await dao.init_db()
+    async for row in dao.query(dao.person.select()):
+        ...
+"""
+import contextlib
+import contextvars
+
+from sqlalchemy.ext import asyncio as sa_asyncio
+
+from . import dao, regimens
+
+
+class AsyncDAO(dao.BaseDAO):
+    """A Data Access Object for asyncio programs.
+
+    Tables are available as on shared_schema.dao.DAO (e.g.
+    "dao.regimen"). Database methods must be awaited, and `query` is an
+    async iterator.
+    """
+
+    def __init__(
+        self,
+        db_url,
+        engine_args=None,
+        schema_data=None,
+        uuid_type=dao.UUID,
+        fk_indexes=True,
+        sqlite_profile=None,
+    ):
+        """Creates an SQLAlchemy AsyncEngine.
+
+        The arguments are the same as shared_schema.dao.DAO's, except
+        that `db_url` has to name an async driver (e.g.
+        "sqlite+aiosqlite:///:memory:" or "postgresql+asyncpg://...").
+        """
+        super().__init__(schema_data, uuid_type, fk_indexes)
+        self._connection = contextvars.ContextVar("connection", default=None)
+        if engine_args is None:
+            engine_args = {}
+        self.engine = sa_asyncio.create_async_engine(db_url, **engine_args)
+        dao.configure_connections(self.engine.sync_engine, sqlite_profile)
+
+    async def init_db(self):
+        "Create or upgrade the tables, as DAO.init_db does"
+
+        def upgrade(conn):
+            dao.upgrade_tables(conn, self._tables)
+
+        self._tables.all()
+        async with self.transaction() as conn:
+            await conn.run_sync(upgrade)
+
+    async def dispose(self):
+        "Close the engine's pooled connections"
+        await self.engine.dispose()
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """Share one connection and one commit between DAO calls.
+
+        Works like DAO.transaction, with `async with`. Transactions are
+        per-task (they follow contextvars), so concurrent tasks sharing
+        a DAO don't share connections.
+        """
+        conn = self._connection.get()
+        if conn is not None:
+            yield conn
+            return
+        async with self.engine.begin() as conn:
+            token = self._connection.set(conn)
+            try:
+                yield conn
+            finally:
+                self._connection.reset(token)
+
+    async def command(self, expr, *rest):
+        async with self.transaction() as conn:
+            return await conn.execute(expr, *rest)
+
+    async def query(self, expr, *rest):
+        """Iterate over a query's results.
+
+        The rows are fetched before the first one is yielded (as with
+        DAO.query), so the connection isn't held while they're used.
+        """
+        async with self.transaction() as conn:
+            result = await conn.execute(expr, *rest)
+            rows = result.fetchall() if result.returns_rows else []
+        for row in rows:
+            yield row
+
+    async def insert_many(self, tablename, items):
+        self._check_items(items)
+        table = self._table(tablename)
+        async with self.transaction() as conn:
+            await conn.execute(table.insert(), items)
+
+    async def insert(self, tablename, item):
+        if not isinstance(item, dict):
+            raise ValueError("Expected a dictionary")
+        stmt = self.statement(tablename, "insert", item.keys())
+        async with self.transaction() as conn:
+            await conn.execute(stmt, item)
+
+    async def insert_or_check_identical(self, tablename, item):
+        pk_values = self._primary_key_values(tablename, item)
+        get = self.statement(tablename, "get")
+        async with self.transaction() as conn:
+            result = await conn.execute(get, pk_values)
+            fetched = result.first()
+            if fetched is None:
+                await self.insert(tablename, item)
+            else:
+                self._check_identical(tablename, fetched, item)
+
+    async def load_regimens(self, named_regimens):
+        "Insert many regimens at once (see DAO.load_regimens)"
+        regimen_rows, inclusion_rows = self._regimen_rows(named_regimens)
+        async with self.transaction() as conn:
+            if regimen_rows:
+                await conn.execute(self.regimen.insert(), regimen_rows)
+            if inclusion_rows:
+                await conn.execute(
+                    self.regimendruginclusion.insert(), inclusion_rows
+                )
+        return [row["id"] for row in regimen_rows]
+
+    async def load_standard_regimens(self):
+        """Populate the Regimen and RegimenDrugInclusion tables with the
+        regimens from shared_schema.regimens.standard
+        """
+        standard_regimens = regimens.cannonical.standard_index().by_name
+        return await self.load_regimens(standard_regimens.items())
+
+    async def get_regimen(self, reg_id):
+        reg_qry = self.statement("regimen", "get")
+        async with self.transaction() as conn:
+            result = await conn.execute(reg_qry, {"id": reg_id})
+            return result.first()
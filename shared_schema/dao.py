@@ -1,12 +1,18 @@
 """Concrete database connection functions and data-access-objects
 
 """
+import collections
+import contextlib
+import io
+import threading
 import typing as ty
 import uuid
+import weakref
 
 import sqlalchemy as sa
 import sqlalchemy.sql as sql
 import sqlalchemy.types as sa_types
+from sqlalchemy.dialects import postgresql
 
 from . import data, datatypes, regimens, tables, util
 
@@ -15,8 +21,15 @@ def constraints(specs: ty.Dict[str, str]) -> ty.List[sa.CheckConstraint]:
     return [sa.CheckConstraint(src, name=name) for name, src in specs.items()]
 
 
-class UUID(sa_types.TypeDecorator):
+class CharUUID(sa_types.TypeDecorator):
+    """UUIDs stored as 32-character hex strings.
+
+    This was the storage for every database before UUID became
+    dialect-aware; pass it as DAO's `uuid_type` to open one of those.
+    """
+
     impl = sa_types.CHAR
+    cache_ok = True
 
     @staticmethod
     def as_str(u):
@@ -38,8 +51,54 @@ class UUID(sa_types.TypeDecorator):
             return uuid.UUID(value)
 
 
-def column_type(field_type, schema_data):
-    dt = datatypes.classify(field_type)
+class UUID(CharUUID):
+    """UUIDs in the most compact storage each database offers.
+
+    PostgreSQL gets its native UUID type, SQLite gets 16 raw bytes, and
+    anything else falls back to CharUUID's 32-character hex strings.
+    """
+
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=True))
+        if dialect.name == "sqlite":
+            return dialect.type_descriptor(sa_types.BLOB(16))
+        return dialect.type_descriptor(sa_types.CHAR(32))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name not in ("postgresql", "sqlite"):
+            return super().process_bind_param(value, dialect)
+        if not isinstance(value, uuid.UUID):
+            msg = "Tried to make a UUID column with a non-uuid value: {}"
+            raise ValueError(msg.format(value))
+        return value if dialect.name == "postgresql" else value.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, uuid.UUID):
+            return value
+        if dialect.name == "sqlite":
+            return uuid.UUID(bytes=bytes(value))
+        return uuid.UUID(value)
+
+    def result_processor(self, dialect, coltype):
+        # NOTE: Join results can carry tens of thousands of
+        # UUIDs, so skip the generic TypeDecorator chain on SQLite.
+        if dialect.name != "sqlite":
+            return super().result_processor(dialect, coltype)
+
+        def process(value):
+            if value is None:
+                return value
+            return uuid.UUID(bytes=value)
+
+        return process
+
+
+def column_type(field_type, schema_data, uuid_type=UUID):
+    parsed = datatypes.parse(field_type)
+    dt = parsed.datatype
     # NOTE(nknight): We're ignoring the 'length' parameter to the
     # string field becuase sqlite and postgres don't require it
     simple_types = {
@@ -47,18 +106,18 @@ def column_type(field_type, schema_data):
         datatypes.Datatype.FLOAT: sa.Float(asdecimal=True),
         datatypes.Datatype.STRING: sa.String(),
         datatypes.Datatype.DATE: sa.Date,
-        datatypes.Datatype.UUID: UUID,
+        datatypes.Datatype.UUID: uuid_type,
         datatypes.Datatype.BOOL: sa.Boolean,
     }
     if dt in simple_types:
         return simple_types.get(dt)
     if dt is datatypes.Datatype.FOREIGN_KEY:
-        target_entity = util.foreign_key_target(field_type)
+        target_entity = parsed.target
         target_entity_pk = schema_data.primary_key_of(target_entity)
         fk_target = "{}.{}".format(target_entity, target_entity_pk)
         return sa.ForeignKey(fk_target)
     if dt is datatypes.Datatype.ENUM:
-        members = [m.lower() for m in util.enum_members(field_type)]
+        members = parsed.members
         if not members:
             msg = "Invalid enum type: {}"
             raise ValueError(msg.format(field_type))
@@ -73,36 +132,565 @@ def is_pk(field: tables.Field, entity: tables.Entity):
     return is_sole_pk or is_compound_pk
 
 
-def as_column(field: tables.Field, entity: tables.Entity, schema_data):
-    col_type = column_type(field.type, schema_data)
+def as_column(
+    field: tables.Field, entity: tables.Entity, schema_data, uuid_type=UUID
+):
+    col_type = column_type(field.type, schema_data, uuid_type)
     name = field.name
     mark_pk = is_pk(field, entity)
     nullable = field.nullable
     return sa.Column(name, col_type, primary_key=mark_pk, nullable=nullable)
 
 
-def as_table(entity: tables.Entity, meta, schema_data):
-    columns = [as_column(f, entity, schema_data) for f in entity.fields]
+def index_columns(spec):
+    "The columns of an index (or primary key) spec from entity metadata"
+    return (spec,) if isinstance(spec, str) else tuple(spec)
+
+
+def indexes(entity: tables.Entity, columns, fk_indexes=True):
+    """Indexes for a table's foreign keys and its declared indexes.
+
+    Foreign key columns are indexed unless they lead the primary key
+    (whose index already covers them). Extra indexes are declared in
+    the entity's metadata as a map of index names to columns, e.g.
+    `"indexes": {"ix_case_study": ("study_name", "person_id")}`.
+    """
+    leading_pk = index_columns(entity.primary_key)[0]
+    result = []
+    if fk_indexes:
+        for col in columns:
+            if col.foreign_keys and col.name != leading_pk:
+                name = "ix_{}_{}".format(entity.name.lower(), col.name)
+                result.append(sa.Index(name, col.name))
+    for name, spec in entity.meta.get("indexes", {}).items():
+        result.append(sa.Index(name, *index_columns(spec)))
+    return result
+
+
+def as_table(
+    entity: tables.Entity, meta, schema_data, uuid_type=UUID, fk_indexes=True
+):
+    columns = [
+        as_column(f, entity, schema_data, uuid_type) for f in entity.fields
+    ]
     check_constraints = constraints(entity.meta.get("constraints", {}))
-    return sa.Table(entity.name, meta, *columns, *check_constraints)
+    table_indexes = indexes(entity, columns, fk_indexes)
+    return sa.Table(
+        entity.name, meta, *columns, *check_constraints, *table_indexes
+    )
+
+
+class SchemaTables(object):
+    """The SQLAlchemy tables for a schema, built as they're needed.
+
+    A table is built the first time it's asked for, along with the
+    tables its foreign keys refer to (so joins and constraints can be
+    resolved). Instances are shared: see `schema_tables`. They only
+    keep a weak reference to the schema (they're cached by it), so the
+    DAOs using them keep the schema alive.
+    """
+
+    def __init__(self, schema_data, uuid_type=UUID, fk_indexes=True):
+        self._schema_ref = weakref.ref(schema_data)
+        self.uuid_type = uuid_type
+        self.fk_indexes = fk_indexes
+        self.meta = sa.MetaData()
+        self.names = {name.lower(): name for name in schema_data.entities}
+        self._lock = threading.RLock()
+
+    @property
+    def schema_data(self):
+        return self._schema_ref()
+
+    def get(self, name):
+        "Get the table for an entity name, or None if there isn't one"
+        name = self.names.get(name.lower())
+        if name is None:
+            return None
+        table = self.meta.tables.get(name)
+        if table is not None:
+            return table
+        with self._lock:
+            table = self.meta.tables.get(name)
+            if table is None:
+                entity = self.schema_data.entities[name]
+                table = as_table(
+                    entity,
+                    self.meta,
+                    self.schema_data,
+                    self.uuid_type,
+                    self.fk_indexes,
+                )
+                for fk in table.foreign_keys:
+                    self.get(fk.target_fullname.split(".")[0])
+            return table
+
+    def all(self):
+        "Build every table, and return them by entity name"
+        return {name: self.get(name) for name in self.names.values()}
+
+
+_schema_tables = weakref.WeakKeyDictionary()
+_schema_tables_lock = threading.Lock()
+
+
+def schema_tables(schema_data, uuid_type=UUID, fk_indexes=True):
+    """Get the SchemaTables for a schema, shared between DAOs.
+
+    The tables are cached per Schema instance (and UUID type and index
+    options), so DAOs for the same schema share one MetaData and only
+    build each table once.
+    """
+    with _schema_tables_lock:
+        by_options = _schema_tables.setdefault(schema_data, {})
+        options = (uuid_type, fk_indexes)
+        if options not in by_options:
+            by_options[options] = SchemaTables(
+                schema_data, uuid_type, fk_indexes
+            )
+        return by_options[options]
+
+
+# PRAGMAs for file-backed SQLite databases, applied to every connection
+# by a DAO created with `sqlite_profile="<name>"`. Negative cache sizes
+# are in KiB.
+SQLITE_PROFILES = {
+    # Fast loads into staging databases: a crash can lose the last
+    # transactions (but won't corrupt the database, thanks to WAL).
+    "bulk-load": collections.OrderedDict(
+        [
+            ("journal_mode", "WAL"),
+            ("synchronous", "OFF"),
+            ("cache_size", -262144),
+            ("temp_store", "MEMORY"),
+            ("mmap_size", 268435456),
+        ]
+    ),
+    # Many concurrent readers and the occasional durable write.
+    "read-mostly": collections.OrderedDict(
+        [
+            ("journal_mode", "WAL"),
+            ("synchronous", "NORMAL"),
+            ("cache_size", -65536),
+            ("temp_store", "MEMORY"),
+            ("mmap_size", 1073741824),
+        ]
+    ),
+}
+
+
+def sqlite_pragmas(profile=None):
+    """The PRAGMAs a DAO sets on each new SQLite connection.
+
+    Foreign key checking (disabled by default in SQLite) is always
+    turned on; a profile from SQLITE_PROFILES adds its settings.
+    """
+    pragmas = collections.OrderedDict([("foreign_keys", "on")])
+    if profile is not None:
+        if profile not in SQLITE_PROFILES:
+            msg = "Unknown SQLite profile: {} (expected one of: {})"
+            raise ValueError(msg.format(profile, ", ".join(SQLITE_PROFILES)))
+        pragmas.update(SQLITE_PROFILES[profile])
+    return pragmas
+
+
+def _on_sqlite_connect(pragmas):
+    statements = [
+        "PRAGMA {} = {}".format(name, value) for name, value in pragmas.items()
+    ]
+
+    def listener(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+
+    return listener
+
+
+Mismatch = collections.namedtuple(
+    "Mismatch", ["table", "key", "field", "existing", "given"]
+)
+
+
+def _copy_field(value):
+    "Format a bound value for PostgreSQL's COPY ... (FORMAT csv)"
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return '"{}"'.format(str(value).replace('"', '""'))
+
+
+def add_missing_columns(conn, table):
+    """Add a table's columns that its database table doesn't have yet.
+
+    Only nullable columns can be added to a table that may have rows;
+    a missing non-nullable column raises ValueError. Returns the names
+    of the added columns.
+    """
+    existing = {
+        col["name"] for col in sa.inspect(conn).get_columns(table.name)
+    }
+    preparer = conn.dialect.identifier_preparer
+    added = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        if not column.nullable:
+            msg = "Can't add the required column {}.{} to an existing table"
+            raise ValueError(msg.format(table.name, column.name))
+        column_ddl = sa.schema.CreateColumn(column).compile(
+            dialect=conn.dialect
+        )
+        conn.execute(
+            sa.text(
+                "ALTER TABLE {} ADD COLUMN {}".format(
+                    preparer.format_table(table), column_ddl
+                )
+            )
+        )
+        added.append(column.name)
+    return added
+
+
+def _uuid_round_trips(column_type, raw, dialect):
+    "Whether a UUID column type reads a stored value and writes it back"
+    if isinstance(raw, memoryview):
+        raw = bytes(raw)
+    load = column_type.result_processor(dialect, None)
+    dump = column_type.bind_processor(dialect)
+    try:
+        value = load(raw) if load is not None else raw
+        stored = dump(value) if dump is not None else value
+    except (ValueError, TypeError, AttributeError):
+        return False
+    return isinstance(value, uuid.UUID) and stored == raw
+
+
+def check_uuid_storage(conn, tables):
+    """Check that a database's UUIDs are stored as the tables expect.
+
+    Databases created before UUID was compacted store CHAR UUIDs, which
+    the default UUID columns can't read (and CharUUID columns can't
+    read compact ones). One stored UUID per existing table is read and
+    written back; raises ValueError if it doesn't survive the trip.
+    """
+    inspector = sa.inspect(conn)
+    existing = set(inspector.get_table_names())
+    for table in tables:
+        if table.name not in existing:
+            continue
+        present = {col["name"] for col in inspector.get_columns(table.name)}
+        uuid_columns = [
+            col
+            for col in table.columns
+            if col.name in present and isinstance(col.type, CharUUID)
+        ]
+        for column in uuid_columns:
+            raw_column = sa.column(column.name)
+            query = (
+                sa.select([raw_column])
+                .select_from(sa.table(table.name))
+                .where(raw_column.isnot(None))
+                .limit(1)
+            )
+            raw = conn.execute(query).scalar()
+            if raw is None:
+                continue
+            if not _uuid_round_trips(column.type, raw, conn.dialect):
+                msg = (
+                    "Can't read the UUIDs stored in {}.{} with {} columns "
+                    "(found {!r}): open databases created before UUIDs "
+                    "were compacted with uuid_type=CharUUID, or copy them "
+                    "with migrate_char_uuids"
+                )
+                raise ValueError(
+                    msg.format(
+                        table.name, column.name, type(column.type).__name__,
+                        raw,
+                    )
+                )
+            break
+
+
+def fill_regimen_keys(conn, schema_tables):
+    """Set Regimen.canonical_key on regimens that don't have one.
+
+    Regimens stored before the key existed are rebuilt from their drug
+    inclusions. Schemas without the Regimen table (or its key) are left
+    alone. Returns the number of regimens updated.
+    """
+    regimen = schema_tables.get("regimen")
+    inclusion = schema_tables.get("regimendruginclusion")
+    if None in (regimen, inclusion) or "canonical_key" not in regimen.c:
+        return 0
+    missing = (
+        regimen.outerjoin(inclusion)
+        .select()
+        .where(regimen.c.canonical_key.is_(None))
+        .order_by(regimen.c.id)
+    )
+    stored = regimens.cannonical.from_rows(conn.execute(missing))
+    if not stored:
+        return 0
+    update = (
+        regimen.update()
+        .where(regimen.c.id == sa.bindparam("reg_id"))
+        .values(canonical_key=sa.bindparam("key"))
+    )
+    keys = [
+        {"reg_id": reg_id, "key": regimens.cannonical.regimen_key(reg)}
+        for reg_id, reg in stored.items()
+    ]
+    conn.execute(update, keys)
+    return len(keys)
+
+
+def upgrade_tables(conn, schema_tables):
+    """Create a schema's missing tables, columns and indexes.
+
+    Run on an existing database, this upgrades it: stored UUIDs are
+    checked first (see `check_uuid_storage`), then nullable columns and
+    indexes that were declared since it was created are added, and
+    regimens without a canonical key get one (see `fill_regimen_keys`).
+    """
+    tables = schema_tables.meta.sorted_tables
+    check_uuid_storage(conn, tables)
+    schema_tables.meta.create_all(conn)
+    for table in tables:
+        add_missing_columns(conn, table)
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+    fill_regimen_keys(conn, schema_tables)
+
+
+def copy_buffer(table, rows, dialect):
+    """Write rows as CSV for COPY FROM STDIN, in table column order.
+
+    Values go through each column type's bind processor, so the result
+    is encoded exactly as an INSERT would encode it (e.g. UUIDs).
+    Missing values and None become NULL (an unquoted empty field);
+    everything else is quoted, so empty strings stay empty strings.
+    """
+    columns = list(table.columns)
+    processors = [col.type.bind_processor(dialect) for col in columns]
+    buffer = io.StringIO()
+    for row in rows:
+        fields = []
+        for col, process in zip(columns, processors):
+            value = row.get(col.name)
+            if process is not None and value is not None:
+                value = process(value)
+            fields.append(_copy_field(value))
+        buffer.write(",".join(fields))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def configure_connections(engine, sqlite_profile=None):
+    "Set up each new connection of a (sync) engine, e.g. SQLite PRAGMAs"
+    if engine.dialect.name == "sqlite":
+        pragmas = sqlite_pragmas(sqlite_profile)
+        sa.event.listen(engine, "connect", _on_sqlite_connect(pragmas))
+    elif sqlite_profile is not None:
+        msg = "Can't use a SQLite profile with a {} database"
+        raise ValueError(msg.format(engine.dialect.name))
+
+
+class BaseDAO(object):
+    """The parts of a DAO that don't talk to the database.
+
+    The tables (as defined by a shared_schema.tables.Schema instance)
+    are available in a dictionary that lives in an attribute called
+    "tables". They're also available directly as attributes on the DOA
+    (in lowercase, e.g. "dao.regimen" or "dao.behaviordata"). Tables
+    are built the first time they're used, and shared between DAOs for
+    the same schema.
+
+    Subclasses set `engine`, and add the methods that use it.
+    """
+
+    def __init__(self, schema_data=None, uuid_type=UUID, fk_indexes=True):
+        self._statements = {}
+        if schema_data is None:
+            schema_data = data.schema_data
+        self._schema_data = schema_data
+        self._tables = schema_tables(schema_data, uuid_type, fk_indexes)
+        self._meta = self._tables.meta
+
+    def __getattr__(self, name):
+        # Only called for missing attributes: build the entity's table
+        # the first time it's used, and keep it as a real attribute.
+        table = None
+        if not name.startswith("_") and name == name.lower():
+            table = self._tables.get(name)
+        if table is None:
+            msg = "{!r} object has no attribute {!r}"
+            raise AttributeError(msg.format(type(self).__name__, name))
+        setattr(self, name, table)
+        return table
+
+    @property
+    def tables(self):
+        "All of the schema's tables, by entity name"
+        return self._tables.all()
 
+    @property
+    def metadata(self):
+        "The schema's MetaData, with every table built"
+        self._tables.all()
+        return self._meta
+
+    def _table(self, name):
+        table = self._tables.get(name)
+        if table is None:
+            raise ValueError("No such table: {}".format(name))
+        return table
+
+    def compiled(self, key, build, **compile_args):
+        """Compile the statement returned by `build()` once per key.
+
+        Later calls with the same key return the cached, compiled
+        statement, which is executed with a dict of parameters (e.g.
+        `dao.query(stmt, {"id": uid})`). Keys should identify everything
+        `build` depends on. Extra keyword arguments go to `compile`.
+        """
+        stmt = self._statements.get(key)
+        if stmt is None:
+            dialect = self.engine.dialect
+            stmt = build().compile(dialect=dialect, **compile_args)
+            self._statements[key] = stmt
+        return stmt
 
-class DAO(object):
+    def statement(self, tablename, operation, columns=()):
+        """A cached, compiled statement for a common table operation.
+
+        Operations are:
+        - "insert"  insert a row with the given columns
+        - "select"  select rows where each of the given columns equals
+                    the parameter of the same name
+        - "get"     select the row with the given primary key (the
+                    parameters are the primary key columns)
+        """
+        table = self._table(tablename)
+        columns = tuple(sorted(columns))
+        if operation == "insert":
+            key = (table.name, operation, columns)
+            return self.compiled(key, table.insert, column_keys=columns)
+        if operation == "get":
+            columns = tuple(sorted(col.name for col in table.primary_key))
+        elif operation != "select":
+            msg = "Unknown statement operation: {}"
+            raise ValueError(msg.format(operation))
+
+        def build():
+            conditions = [table.c[col] == sa.bindparam(col) for col in columns]
+            return table.select().where(sql.and_(*conditions))
+
+        return self.compiled((table.name, "select", columns), build)
+
+    @staticmethod
+    def _check_items(items):
+        if not isinstance(items, list):
+            raise ValueError("insert_many expects a list")
+        if any(not isinstance(i, dict) for i in items):
+            raise ValueError("Expected a list of dictionaries")
+
+    def _primary_key_values(self, tablename, item):
+        table = self._table(tablename)
+        return {col.name: item.get(col.name) for col in table.primary_key}
+
+    @staticmethod
+    def _check_identical(tablename, fetched, item):
+        tmpl = (
+            "Mismatch in expected datbase value: "
+            "{tbl}.{fld} : {pre} != {given}"
+        )
+        for key, given in item.items():
+            existing = getattr(fetched, key, None)
+            if existing != given:
+                msg = tmpl.format(
+                    tbl=tablename, fld=key, pre=existing, given=given
+                )
+                raise ValueError(msg)
+
+    @staticmethod
+    def _full_rows(table, rows):
+        """Rows with every column of the table, missing values as None.
+
+        An executemany takes its columns from the first row, so rows
+        with different keys are expanded before they're inserted
+        together (as copy_buffer does for COPY).
+        """
+        names = table.columns.keys()
+        return [{name: row.get(name) for name in names} for row in rows]
+
+    @staticmethod
+    def _inclusion_rows(reg_id, regdata):
+        inclusions = regimens.cannonical.drug_inclusions(regdata)
+        return [
+            {
+                "regimen_id": reg_id,
+                "medication_id": incl.medication_id.lower(),
+                "dose": incl.dose,
+                "frequency": incl.frequency.lower(),
+                "duration": incl.duration,
+            }
+            for incl in inclusions
+        ]
+
+    def _regimen_rows(self, named_regimens):
+        "Regimen and RegimenDrugInclusion rows for (name, regimen) pairs"
+        regimen_rows = []
+        inclusion_rows = []
+        for regname, regdata in named_regimens:
+            if isinstance(regdata, str):
+                regdata = regimens.cannonical.from_string(regdata)
+            reg_id = uuid.uuid4()
+            reg_key = regimens.cannonical.regimen_key(regdata)
+            regimen_rows.append(
+                {"id": reg_id, "name": regname, "canonical_key": reg_key}
+            )
+            inclusion_rows.extend(self._inclusion_rows(reg_id, regdata))
+        return regimen_rows, inclusion_rows
+
+
+class DAO(BaseDAO):
     """A Data Access Object (DAO) that conforms to the SHARED Schema.
 
     The tables (as defined by a shared_schema.tables.Schema instance)
     are available in a dictionary that lives in an attribute called
     "tables". They're also available directly as attributes on the DOA
-    (in lowercase, e.g. "dao.regimen" or "dao.behaviordata").
+    (in lowercase, e.g. "dao.regimen" or "dao.behaviordata"). Tables
+    are built the first time they're used, and shared between DAOs for
+    the same schema.
     """
 
-    def __init__(self, db_url, engine_args=None, schema_data=None):
+    def __init__(
+        self,
+        db_url,
+        engine_args=None,
+        schema_data=None,
+        fetch_size=1000,
+        uuid_type=UUID,
+        fk_indexes=True,
+        sqlite_profile=None,
+    ):
         """Connects to the database and creates as SqlAlchemy engine.
 
         Arguments:
         - db_url        the connection string of the database to use
         - schema_data   an instance of shared_schema.tables.Schema
         - engine_args   a map of keyword args for sqlalchemy.create_engine
+        - fetch_size    how many rows `stream` fetches at a time
+        - uuid_type     the column type for UUIDs (CharUUID opens
+                        databases created before UUID was compacted)
+        - fk_indexes    whether to index foreign key columns
+        - sqlite_profile
+                        the name of a SQLITE_PROFILES entry to apply to
+                        each connection (e.g. "bulk-load")
 
         Use the database URL "sqlite:///:memory:" for an ephemeral
         testing database.
@@ -110,54 +698,93 @@ class DAO(object):
         If isn't provided, "shared_schema.data.schema_data" is used by
         default.
         """
+        super().__init__(schema_data, uuid_type, fk_indexes)
         self._db_url = db_url
-        self._meta = sa.MetaData()
-        self.tables = {}
-        if schema_data is None:
-            schema_data = data.schema_data
-        for entity in schema_data.entities.values():
-            tbl = as_table(entity, self._meta, schema_data)
-            self.tables[entity.name] = tbl
-            setattr(self, entity.name.lower(), tbl)
+        self._local = threading.local()
+        self.fetch_size = fetch_size
         if engine_args is None:
             engine_args = {}
         self.engine = sa.create_engine(db_url, **engine_args)
-        # Enable foreign key checking (disabled by default in SQLite)"
-        if "sqlite" in self._db_url.lower():
-            with self.engine.connect() as conn:
-                conn.execute("PRAGMA foreign_keys = on")
+        configure_connections(self.engine, sqlite_profile)
 
     def init_db(self):
-        self._meta.create_all(self.engine)
+        """Create any missing tables, columns and indexes.
+
+        Running this on an existing database upgrades it, in one
+        transaction (see `upgrade_tables`). The stored UUIDs are checked
+        before anything is changed, since SQLite keeps the DDL that ran
+        before a failure.
+        """
+        self._tables.all()
+        with self.transaction() as conn:
+            upgrade_tables(conn, self._tables)
+
+    def backfill_regimen_keys(self):
+        "Set Regimen.canonical_key where it's missing (see fill_regimen_keys)"
+        with self.transaction() as conn:
+            return fill_regimen_keys(conn, self._tables)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Share one connection and one commit between DAO calls.
+
+        Inside the block, every DAO method (insert, insert_many, query,
+        command, ...) uses the same connection, and everything is
+        committed together when the block exits (or rolled back if it
+        raises):
+
+            with dao.transaction() as conn:
+                dao.insert("person", person)
+                dao.insert_many("case", cases)
+
+        Nested blocks join the outermost transaction. Transactions are
+        per-thread, so threads sharing a DAO don't share connections.
+        """
+        conn = getattr(self._local, "connection", None)
+        if conn is not None:
+            yield conn
+            return
+        with self.engine.begin() as conn:
+            self._local.connection = conn
+            try:
+                yield conn
+            finally:
+                self._local.connection = None
 
     def load_standard_regimens(self):
         """Populate the Regimen and RegimenDrugInclusion tables with the
         regimens from shared_schema.regimens.standard
         """
-        for regname, regspec in regimens.standard.regimens.items():
-            with self.engine.begin():
-                reg_id = uuid.uuid4()
-                self.insert("regimen", {"id": reg_id, "name": regname})
-                regdata = regimens.cannonical.from_string(regspec)
-                inclusions = regimens.cannonical.drug_inclusions(regdata)
-                inclusion_data = [
-                    {
-                        "regimen_id": reg_id,
-                        "medication_id": incl.medication_id.lower(),
-                        "dose": incl.dose,
-                        "frequency": incl.frequency.lower(),
-                        "duration": incl.duration,
-                    }
-                    for incl in inclusions
-                ]
-                self.insert_many("regimendruginclusion", inclusion_data)
+        standard_regimens = regimens.cannonical.standard_index().by_name
+        return self.load_regimens(standard_regimens.items())
+
+    def load_regimens(self, named_regimens):
+        """Insert many regimens at once.
+
+        Takes an iterable of (name, regimen) pairs, where each regimen
+        is either a string that shared_schema.regimens.cannonical
+        can parse or an already canonical regimen. Every Regimen and
+        RegimenDrugInclusion row is inserted in a single transaction,
+        with one executemany per table.
+
+        Returns the new regimens' ids, in the order they were given.
+        """
+        regimen_rows, inclusion_rows = self._regimen_rows(named_regimens)
+        with self.transaction() as conn:
+            if regimen_rows:
+                conn.execute(self.regimen.insert(), regimen_rows)
+            if inclusion_rows:
+                conn.execute(
+                    self.regimendruginclusion.insert(), inclusion_rows
+                )
+        return [row["id"] for row in regimen_rows]
 
     def command(self, expr, *rest):
-        with self.engine.begin() as conn:
+        with self.transaction() as conn:
             return conn.execute(expr, *rest)
 
     def query(self, expr, *rest):
-        with self.engine.begin() as conn:
+        with self.transaction() as conn:
             cursor = conn.execute(expr, *rest)
             if cursor is not None and hasattr(cursor, "fetchall"):
                 results = list(cursor.fetchall())
@@ -165,48 +792,236 @@ class DAO(object):
                 results = []
         return iter(results)
 
+    def stream(self, expr, *rest, fetch_size=None):
+        """Iterate over a query's results without loading them all at once.
+
+        Rows are fetched `fetch_size` at a time (the DAO's fetch_size by
+        default) through a server-side cursor, where the database
+        driver supports one (e.g. psycopg2), so memory use doesn't grow
+        with the size of the result. The connection stays checked out
+        until the iterator is exhausted or closed. Inside
+        `transaction()`, the transaction's connection is used.
+        """
+        if fetch_size is None:
+            fetch_size = self.fetch_size
+        conn = getattr(self._local, "connection", None)
+        if conn is not None:
+            yield from self._fetch_in_batches(conn, fetch_size, expr, rest)
+        else:
+            with self.engine.connect() as conn:
+                yield from self._fetch_in_batches(
+                    conn, fetch_size, expr, rest
+                )
+
+    @staticmethod
+    def _fetch_in_batches(conn, fetch_size, expr, rest):
+        streaming = conn.execution_options(
+            stream_results=True, max_row_buffer=fetch_size
+        )
+        result = streaming.execute(expr, *rest)
+        try:
+            while True:
+                rows = result.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            result.close()
+
     def insert_many(self, tablename, items):
-        if not isinstance(items, list):
-            raise ValueError("insert_many expects a list")
-        if any(not isinstance(i, dict) for i in items):
-            raise ValueError("Expected a list of dictionaries")
+        self._check_items(items)
         table = getattr(self, tablename)
         if table is None:
             raise ValueError("No such table: {}".format(tablename))
         ins = table.insert()
-        with self.engine.begin() as conn:
+        with self.transaction() as conn:
             conn.execute(ins, *items)
 
+    def bulk_load(self, entity_name, rows, batch_size=10000):
+        """Load a large number of rows into a table, quickly.
+
+        Takes a schema entity name (e.g. "Substitution", or "substitution")
+        and an iterable of dicts, which is consumed `batch_size` rows at a
+        time. All batches go in in a single transaction (or the caller's,
+        inside `transaction()`). On PostgreSQL with psycopg2 each batch is
+        sent with COPY FROM STDIN; elsewhere each batch is one
+        executemany. Values are encoded by the column types (see
+        `copy_buffer`), and the database still enforces enum and check
+        constraints.
+
+        Returns the number of rows loaded.
+        """
+        table = self._table(entity_name)
+        column_names = set(table.columns.keys())
+        loaded = 0
+        with self.transaction() as conn:
+            use_copy = (
+                conn.dialect.name == "postgresql"
+                and conn.dialect.driver == "psycopg2"
+            )
+            for batch in util.chunks(rows, batch_size):
+                for row in batch:
+                    if not row.keys() <= column_names:
+                        unknown = ", ".join(sorted(row.keys() - column_names))
+                        msg = "Unknown column(s) for {}: {}"
+                        raise ValueError(msg.format(table.name, unknown))
+                if use_copy:
+                    self._copy(conn, table, batch)
+                else:
+                    conn.execute(table.insert(), self._full_rows(table, batch))
+                loaded += len(batch)
+        return loaded
+
+    @staticmethod
+    def _copy(conn, table, batch):
+        preparer = conn.dialect.identifier_preparer
+        columns = ", ".join(preparer.quote(c.name) for c in table.columns)
+        statement = "COPY {table} ({columns}) FROM STDIN WITH CSV".format(
+            table=preparer.format_table(table), columns=columns
+        )
+        buffer = copy_buffer(table, batch, conn.dialect)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(statement, buffer)
+        finally:
+            cursor.close()
+
     def insert(self, tablename, item):
-        return self.insert_many(tablename, [item])
+        if not isinstance(item, dict):
+            raise ValueError("Expected a dictionary")
+        stmt = self.statement(tablename, "insert", item.keys())
+        with self.transaction() as conn:
+            conn.execute(stmt, item)
 
     def insert_or_check_identical(self, tablename, item):
-        table = getattr(self, tablename)
-        if table is None:
-            raise ValueError("No such table: {}".format(tablename))
-        pk_cols = list(table.primary_key)
-        identical = [col == item.get(col.name) for col in pk_cols]
-        fetched = next(
-            self.query(table.select().where(sql.and_(*identical))), None
-        )
+        pk_values = self._primary_key_values(tablename, item)
+        get = self.statement(tablename, "get")
+        fetched = next(self.query(get, pk_values), None)
         if fetched is None:
             self.insert(tablename, item)
         else:
-            tmpl = (
-                "Mismatch in expected datbase value: "
-                "{tbl}.{fld} : {pre} != {given}"
-            )
-            for key, given in item.items():
-                if getattr(fetched, key, None) != given:
-                    msg = tmpl.format(
-                        tbl=tablename,
-                        fld=key,
-                        pre=fetched.get(key),
-                        given=given,
-                    )
-                    raise ValueError(msg)
+            self._check_identical(tablename, fetched, item)
+
+    def insert_or_check_identical_many(self, tablename, items, batch_size=500):
+        """Batch version of insert_or_check_identical.
+
+        For each batch of `batch_size` items, the rows that already exist
+        are fetched with a single query on the primary key (compound keys
+        are matched as tuples), items that don't exist yet are inserted
+        with one executemany, and items that do exist are compared with
+        the stored rows. Everything happens in one transaction.
+
+        Instead of raising on the first difference, returns a list of
+        Mismatch(table, key, field, existing, given) tuples, where `key`
+        is the tuple of primary key values. An empty list means every
+        item was either inserted or already present and identical.
+        """
+        table = self._table(tablename)
+        pk_cols = list(table.primary_key)
+        pk_names = [col.name for col in pk_cols]
+        mismatches = []
+        with self.transaction() as conn:
+            for batch in util.chunks(items, batch_size):
+                keyed = [
+                    (tuple(item.get(name) for name in pk_names), item)
+                    for item in batch
+                ]
+                existing = self._fetch_by_keys(
+                    conn, table, pk_cols, {key for key, _ in keyed}
+                )
+                new_items = []
+                for key, item in keyed:
+                    stored = existing.get(key)
+                    if stored is None:
+                        existing[key] = item
+                        new_items.append(item)
+                        continue
+                    for field, given in item.items():
+                        if stored.get(field) != given:
+                            mismatches.append(
+                                Mismatch(
+                                    table=tablename,
+                                    key=key,
+                                    field=field,
+                                    existing=stored.get(field),
+                                    given=given,
+                                )
+                            )
+                if new_items:
+                    new_rows = self._full_rows(table, new_items)
+                    conn.execute(table.insert(), new_rows)
+        return mismatches
+
+    @staticmethod
+    def _fetch_by_keys(conn, table, pk_cols, keys):
+        if len(pk_cols) == 1:
+            condition = pk_cols[0].in_([key[0] for key in keys])
+        else:
+            condition = sa.tuple_(*pk_cols).in_(list(keys))
+        rows = conn.execute(table.select().where(condition))
+        return {
+            tuple(row[col.name] for col in pk_cols): {
+                name: row[name] for name in row.keys()
+            }
+            for row in rows
+        }
 
     def get_regimen(self, reg_id) -> ty.Optional[uuid.UUID]:
-        reg_qry = self.regimen.select(self.regimen.c.id == reg_id)
-        result = next(self.query(reg_qry), None)
+        reg_qry = self.statement("regimen", "get")
+        result = next(self.query(reg_qry, {"id": reg_id}), None)
         return result
+
+
+def copy_data(source: DAO, dest: DAO, batch_size=10000):
+    """Copy every row from one DAO's database into another's.
+
+    Tables are copied parents-first (so foreign keys are satisfied),
+    streaming from `source` and bulk loading into `dest` in a single
+    transaction. The destination tables must exist and be empty.
+
+    Only the columns that the source database actually has are copied
+    (it may predate some of them), and copied regimens without a
+    canonical key get one.
+
+    Returns a dict of the number of rows copied into each table.
+    """
+    copied = {}
+    inspector = sa.inspect(source.engine)
+    source_tables = set(inspector.get_table_names())
+    with dest.transaction():
+        for table in dest.metadata.sorted_tables:
+            if table.name not in source_tables:
+                copied[table.name] = 0
+                continue
+            source_table = source.tables[table.name]
+            present = {
+                col["name"] for col in inspector.get_columns(table.name)
+            }
+            columns = [
+                col for col in source_table.columns if col.name in present
+            ]
+            rows = (dict(row) for row in source.stream(sa.select(columns)))
+            copied[table.name] = dest.bulk_load(table.name, rows, batch_size)
+        dest.backfill_regimen_keys()
+    return copied
+
+
+def migrate_char_uuids(
+    legacy_url, dest: DAO, engine_args=None, schema_data=None, **kwargs
+):
+    """Copy a database with CHAR-encoded UUIDs into `dest`.
+
+    Databases created before UUID picked a compact storage per dialect
+    keep their UUIDs as 32-character hex strings. This opens the one at
+    `legacy_url` with CharUUID columns, creates the tables in `dest`,
+    and copies every row (see `copy_data`; extra keyword arguments are
+    passed to it).
+    """
+    legacy = DAO(
+        legacy_url,
+        engine_args=engine_args,
+        schema_data=schema_data,
+        uuid_type=CharUUID,
+    )
+    dest.init_db()
+    return copy_data(legacy, dest, **kwargs)
@@ -7,6 +7,23 @@ field = Field.make
 drug_ids = [code for _, code in standard._compounds]
 drug_id_enum_type = "enum({})".format(", ".join(i.lower() for i in drug_ids))
 
+_SUBSTITUTION_CONTENT = {
+    "simple": {"sub_aa"},
+    "insertion": {"insertion"},
+    "deletion": {"deletion_length"},
+}
+
+
+def content_matches_kind(row):
+    "Substitution's content_matches_kind constraint, for a row (dict)"
+    present = {
+        name
+        for name in ("sub_aa", "insertion", "deletion_length")
+        if row.get(name) is not None
+    }
+    return present == _SUBSTITUTION_CONTENT.get(row.get("kind"))
+
+
 schema_data = Schema(
     [
         # ==================================================
@@ -143,7 +160,16 @@ schema_data = Schema(
                     ),
                 ),
             ],
-            meta={"tags": {"clinical"}, "primary key": "id"},
+            meta={
+                "tags": {"clinical"},
+                "primary key": "id",
+                "indexes": {
+                    "ix_case_study_participant_id": (
+                        "study_participant_id",
+                        "study_name",
+                    ),
+                },
+            },
         ),
         Entity.make(
             "BehaviorData",
@@ -391,8 +417,19 @@ schema_data = Schema(
                     "string",
                     "The trade name of this treatment, if applicable",
                 ),
+                field(
+                    "canonical_key",
+                    "string",
+                    "A hash of the regimen's canonical form (identical "
+                    "regimens have the same key)",
+                    meta={"tags": {"managed"}},
+                ),
             ],
-            meta={"tags": {"clinical"}, "primary key": "id"},
+            meta={
+                "tags": {"clinical"},
+                "primary key": "id",
+                "indexes": {"ix_regimen_canonical_key": "canonical_key"},
+            },
         ),
         Entity.make(
             "RegimenDrugInclusion",
@@ -821,6 +858,7 @@ schema_data = Schema(
                         END
                     """
                 },
+                "row checks": {"content_matches_kind": content_matches_kind},
             },
         ),
         # ==================================================
@@ -1,7 +1,11 @@
 """This module defines the datatypes in the SHARED schema.
 """
 
+import collections
 import enum
+import functools
+
+from . import util
 
 # NOTE(nknight): MyPy doesn't support keyword args for namedtuples. See mypy
 # issue 4184: https://github.com/python/mypy/issues/4184
@@ -24,18 +28,43 @@ Datatype = enum.Enum(  # type: ignore
 TYPE_MAP = {dt.name.lower(): dt for dt in Datatype}
 
 
+FieldType = collections.namedtuple(
+    "FieldType", ["datatype", "members", "target"]
+)
+FieldType.__doc__ = """A parsed field type.
+
+`members` is the tuple of an ENUM's (lowercase) members, and `target`
+is the entity a FOREIGN_KEY refers to; both are None for other types.
+"""
+
+
 def classify(src):
+    return parse(src).datatype
+
+
+def parse(src):
+    """Parse a field type string (e.g. "enum(a, b)") into a FieldType.
+
+    Results are cached, so parsing the same type again is a lookup.
+    """
     if type(src) is not str:
         msg = "Expecting a string, but got '{}' instead"
         raise ValueError(msg.format(src))
+    return _parse(src)
+
+
+@functools.lru_cache(maxsize=None)
+def _parse(src):
     normed_src = src.lower().strip()
     if normed_src in TYPE_MAP:
         # covers everything except ENUM and FOREIGN_KEY
-        return TYPE_MAP.get(normed_src)
+        return FieldType(TYPE_MAP.get(normed_src), None, None)
     if normed_src.startswith("enum"):
-        return Datatype.ENUM
+        members = tuple(util.enum_members(src))
+        return FieldType(Datatype.ENUM, members, None)
     if normed_src.startswith("foreign key"):
-        return Datatype.FOREIGN_KEY
+        target = util.foreign_key_target(src)
+        return FieldType(Datatype.FOREIGN_KEY, None, target)
     else:
         msg = "Can't parse a datatype from '{}'"
         raise ValueError(msg.format(src))
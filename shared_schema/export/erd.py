@@ -8,6 +8,7 @@ Information about `erviz` can be found at:
 import io
 import typing as ty
 
+import shared_schema.datatypes as datatypes
 import shared_schema.tables as tables
 
 
@@ -15,7 +16,8 @@ def field_def(fld: tables.Field) -> str:
     "Construct the field definition for a single entity field."
     meta = fld.meta
     reqd = "*" if "required" in meta.get("tags", set()) else " "
-    fk = "*" if "foreign key" in fld.type else ""
+    is_fk = fld.parsed_type.datatype is datatypes.Datatype.FOREIGN_KEY
+    fk = "*" if is_fk else ""
     return " {reqd}{name}{fk}".format(reqd=reqd, name=fld.name, fk=fk)
 
 
@@ -10,6 +10,7 @@ import csv
 import sys
 
 from . import cannonical  # noqa
+from . import compact  # noqa
 from . import grammar  # noqa
 from . import standard  # noqa
 
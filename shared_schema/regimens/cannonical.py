@@ -1,13 +1,29 @@
 """A hashable, eq'able, canonical representation of drug regimens"""
+import array
 import collections
+import concurrent.futures
 import decimal
 import functools
+import hashlib
+import itertools
+import math
+import os
+import re
+import threading
+import types
 import uuid
 
 import sqlalchemy.sql as sql
 
+from shared_schema import util
+
 from . import grammar, standard
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # flake8: noqa
 
 # NOTE(nknight): We don't consider grammar.TimeUnit or grammar.Number
@@ -48,6 +64,13 @@ _regimen_part = collections.namedtuple(
     "RegimenPart", ["drug_combination", "duration"]
 )
 
+# NOTE: The namedtuples are bound to different names than their
+# type names, so point pickle at the module attributes; regimens are
+# sent between processes by `canonicalize_many`.
+_dose.__qualname__ = "_dose"
+_indication.__qualname__ = "_indication"
+_regimen_part.__qualname__ = "_regimen_part"
+
 
 @functools.singledispatch
 def key(x):
@@ -93,19 +116,36 @@ def consolidating_insert(collection, newobj):
     The collection should contain only instances of the same class as
     newobj.
     """
-    maybe_obj = next(iter(collection), None)
-    if maybe_obj is not None:
-        if type(maybe_obj) is not type(newobj):
-            msg = "Can't insert {} into a set of {}"
-            raise ValueError(msg.format(newobj, maybe_obj))
-    matches = [obj for obj in collection if key(obj) == key(newobj)]
-    others = [obj for obj in collection if key(obj) != key(newobj)]
-    consolidated = functools.reduce(add, matches, newobj)
-    return frozenset([consolidated] + others)
+    return consolidating_merge([newobj], collection)
 
 
 def consolidating_merge(xs, ys):
-    return functools.reduce(consolidating_insert, xs, ys)
+    """Consolidate the objects of two collections into one frozenset.
+
+    Objects are grouped by `key` in one pass, and then each group is
+    folded with `add`, so this is linear in the number of objects
+    (rather than inserting them one at a time). `key` and `add` are
+    dispatched once, on the type of the first object, and every object
+    must have that type.
+    """
+    groups = {}
+    first = key_of = None
+    for obj in itertools.chain(ys, xs):
+        if first is None:
+            first = obj
+            key_of = key.dispatch(type(first))
+        elif type(obj) is not type(first):
+            msg = "Can't insert {} into a set of {}"
+            raise ValueError(msg.format(obj, first))
+        group = groups.setdefault(key_of(obj), [])
+        group.append(obj)
+    if first is None:
+        return frozenset()
+    add_to = add.dispatch(type(first))
+    return frozenset(
+        group[0] if len(group) == 1 else functools.reduce(add_to, group)
+        for group in groups.values()
+    )
 
 
 def consolidate(xs):
@@ -238,6 +278,189 @@ def _(src):
     return frozenset(parts)
 
 
+# ---------------------------------------------------------------------
+# Compiled Parser
+"""A hand-written parser for the regimen grammar.
+
+It accepts exactly the same language as `grammar.Regimen` (including
+pypeg2's whitespace rules: whitespace may follow any token, except
+inside a Dose, where the amount and "mg" are contiguous and exactly one
+space separates them from the compound). Instead of building a pypeg2
+object tree and walking it with `_parse`, it builds the canonical data
+objects as it goes.
+"""
+
+_whitespace = re.compile(r"(?m)\s*")
+_word = re.compile(r"\w+")
+_number = grammar.Number.grammar
+_dose_pattern = re.compile(
+    r"({number})mg (\w+)".format(number=grammar.Number.grammar.pattern)
+)
+_compound_set = frozenset(grammar._compounds)
+_freq_set = frozenset(grammar._freqs)
+_time_unit_set = frozenset(grammar._time_units)
+
+
+class _RegimenScanner(object):
+    """Recursive-descent scanner over a single regimen string
+
+    Each rule takes a position and returns a tuple of the position after
+    the match (with trailing whitespace skipped) and the matched value,
+    or None if the rule doesn't match. Like pypeg2's repetitions, a
+    failed optional or repeated group leaves the position where it was.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.error_pos = -1
+        self.error_msg = None
+
+    def fail(self, pos, msg):
+        if pos >= self.error_pos:
+            self.error_pos = pos
+            self.error_msg = msg
+        return None
+
+    def syntax_error(self):
+        pos = max(self.error_pos, 0)
+        line_start = self.text.rfind("\n", 0, pos) + 1
+        line_end = self.text.find("\n", pos)
+        if line_end == -1:
+            line_end = len(self.text)
+        err = SyntaxError(self.error_msg)
+        err.lineno = self.text.count("\n", 0, pos) + 1
+        err.offset = pos - line_start + 1
+        err.text = self.text[line_start:line_end]
+        return err
+
+    def skip(self, pos):
+        return _whitespace.match(self.text, pos).end()
+
+    def keyword(self, pos, members, name):
+        match = _word.match(self.text, pos)
+        if match is None:
+            return self.fail(pos, "expecting {}".format(name))
+        word = match.group(0)
+        if word not in members:
+            msg = "{!r} is not a valid {}".format(word, name)
+            return self.fail(pos, msg)
+        return self.skip(match.end()), word
+
+    def dose(self, pos):
+        match = _dose_pattern.match(self.text, pos)
+        if match is None:
+            return self.fail(pos, "expecting a dose (e.g. '100mg sof')")
+        amount, compound = match.groups()
+        if compound not in _compound_set:
+            msg = "{!r} is not a valid Compound".format(compound)
+            return self.fail(match.start(2), msg)
+        dose = _dose(amount=decimal.Decimal(amount), compound=compound)
+        return self.skip(match.end()), dose
+
+    def indication(self, pos):
+        text = self.text
+        if text.startswith("(", pos):
+            pos = self.skip(pos + 1)
+        result = self.dose(pos)
+        if result is None:
+            return None
+        pos, dose = result
+        doses = [dose]
+        while text.startswith("+", pos):
+            result = self.dose(self.skip(pos + 1))
+            if result is None:
+                break
+            pos, dose = result
+            doses.append(dose)
+        if text.startswith(")", pos):
+            pos = self.skip(pos + 1)
+        result = self.keyword(pos, _freq_set, "Frequency")
+        if result is None:
+            return None
+        pos, frequency = result
+        indication = _indication(
+            doselist=frozenset(consolidate(doses)), frequency=frequency
+        )
+        return pos, indication
+
+    def duration(self, pos):
+        match = _number.match(self.text, pos)
+        if match is None:
+            return self.fail(pos, "expecting a duration (e.g. '12 weeks')")
+        amount = decimal.Decimal(match.group(0))
+        pos = self.skip(match.end())
+        result = self.keyword(pos, _time_unit_set, "TimeUnit")
+        if result is None:
+            return None
+        pos, unit = result
+        if unit.startswith("week"):
+            amount = amount * 7
+        return pos, amount
+
+    def regimen_part(self, pos):
+        text = self.text
+        result = self.indication(pos)
+        if result is None:
+            return None
+        pos, indication = result
+        indications = [indication]
+        while text.startswith("&", pos):
+            result = self.indication(self.skip(pos + 1))
+            if result is None:
+                break
+            pos, indication = result
+            indications.append(indication)
+        result = self.duration(pos)
+        if result is None:
+            return None
+        pos, days = result
+        return pos, (indications, days)
+
+    def regimen(self):
+        text = self.text
+        result = self.regimen_part(self.skip(0))
+        if result is None:
+            raise self.syntax_error()
+        pos, part = result
+        parts = [part]
+        while text.startswith(",", pos):
+            result = self.regimen_part(self.skip(pos + 1))
+            if result is None:
+                break
+            pos, part = result
+            parts.append(part)
+        if pos != len(text):
+            self.fail(pos, "expecting ',' or the end of the regimen")
+            raise self.syntax_error()
+        return parts
+
+
+def _duration_days(days):
+    if int(days) != days:
+        raise ValueError("Fractional days in regimen duration")
+    return int(days)
+
+
+def compiled_parse(src):
+    """Parse a regimen string directly into its canonical form
+
+    Produces the same object as `parse(grammar.parse(src))`, and raises
+    the same exceptions (SyntaxError for text that doesn't match the
+    grammar, ValueError for fractional durations), without building an
+    intermediate pypeg2 tree.
+    """
+    parts = _RegimenScanner(src).regimen()
+    return frozenset(
+        consolidate(
+            _regimen_part(
+                drug_combination=frozenset(consolidate(indications)),
+                duration=_duration_days(days),
+            )
+            for indications, days in parts
+        )
+    )
+
+
 # ---------------------------------------------------------------------
 # Create Regimens
 
@@ -290,22 +513,263 @@ def parse(src):
     return _parse(src)
 
 
-def from_string(src):
+def grammar_parse(src):
+    """Parse a regimen string with the pypeg2 grammar, then canonicalize it"""
+    return _parse(grammar.parse(src))
+
+
+BACKENDS = {"pypeg2": grammar_parse, "compiled": compiled_parse}
+
+_default_backend = "compiled"
+
+
+def _get_backend(name):
+    if name is None:
+        name = _default_backend
+    backend = BACKENDS.get(name)
+    if backend is None:
+        msg = "Unknown regimen parser backend '{}' (expected one of: {})"
+        raise ValueError(msg.format(name, ", ".join(sorted(BACKENDS))))
+    return backend
+
+
+def set_default_backend(name):
+    """Select the parser backend that `from_string` uses by default
+
+    Valid names are the keys of BACKENDS. Both backends produce
+    identical results; "pypeg2" is kept for cross-checking.
+    """
+    global _default_backend
+    _get_backend(name)
+    _default_backend = name
+
+
+# NOTE: Whitespace is only significant inside a Dose, where
+# exactly one space must follow "mg". Runs of whitespace anywhere else
+# can be collapsed without changing what a string parses to.
+_collapsible_whitespace = re.compile(r"(?<!mg)\s+")
+
+
+def normalize_source(src):
+    """Normalize a regimen string without changing what it parses to
+
+    Standard regimen names (which `from_string` matches
+    case-insensitively) are replaced with their contents, and
+    insignificant whitespace is collapsed. Case is otherwise preserved
+    because the grammar is case-sensitive ("400mg SOF" is an error).
+    """
+    if src.upper() in standard.regimens:
+        src = standard.regimens.get(src.upper())
+    return _collapsible_whitespace.sub(" ", src).strip()
+
+
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "maxsize", "currsize"]
+)
+
+DEFAULT_CACHE_SIZE = 4096
+
+
+class RegimenCache(object):
+    """A bounded, least-recently-used cache of parsed regimens
+
+    Canonical regimens are immutable (frozensets of namedtuples), so
+    the cached objects are shared between callers. Failed parses
+    aren't cached. A maxsize of None makes the cache unbounded, and 0
+    disables it.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        if maxsize is not None and maxsize < 0:
+            raise ValueError("Cache size must be non-negative or None")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return value
+        value = compute()
+        if self.maxsize == 0:
+            return value
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return value
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(
+                hits=self.hits,
+                misses=self.misses,
+                maxsize=self.maxsize,
+                currsize=len(self._entries),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_cache = RegimenCache()
+
+
+def cache_info():
+    """Hit/miss counters and size of the `from_string` cache"""
+    return _cache.info()
+
+
+def cache_clear():
+    """Empty the `from_string` cache and reset its counters"""
+    _cache.clear()
+
+
+def set_cache_size(maxsize):
+    """Replace the `from_string` cache with an empty one of a new size"""
+    global _cache
+    _cache = RegimenCache(maxsize)
+
+
+StandardIndex = collections.namedtuple(
+    "StandardIndex", ["by_name", "by_regimen"]
+)
+
+
+@functools.lru_cache(maxsize=None)
+def standard_index():
+    """The canonical forms of the standard regimens (computed once)
+
+    Returns a StandardIndex of two read-only mappings:
+
+    - by_name: standard regimen name -> canonical regimen
+    - by_regimen: canonical regimen -> tuple of standard names
+    """
+    by_name = {
+        name: compiled_parse(src) for name, src in standard.regimens.items()
+    }
+    names_by_regimen = collections.defaultdict(list)
+    for name, regimen in by_name.items():
+        names_by_regimen[regimen].append(name)
+    by_regimen = {
+        regimen: tuple(sorted(names))
+        for regimen, names in names_by_regimen.items()
+    }
+    return StandardIndex(
+        by_name=types.MappingProxyType(by_name),
+        by_regimen=types.MappingProxyType(by_regimen),
+    )
+
+
+def standard_names(regimen):
+    """The names of the standard regimens equal to a canonical regimen
+
+    Returns an empty tuple if the regimen isn't a standard one.
+    """
+    return standard_index().by_regimen.get(regimen, ())
+
+
+def from_string(src, backend=None):
     """Parse a regimen from a string
 
     Given the name of a standard regimen or a well-formed regimen
     description, returns a data object with the normalized
     regimen. Otherwise, throws a SyntaxError.
+
+    Standard regimens are looked up in `standard_index`. Other
+    regimens are parsed with the named backend (see BACKENDS; the
+    default is set with `set_default_backend`) and cached by their
+    normalized source text (see `normalize_source` and `cache_info`).
     """
-    if src.upper() in standard.regimens:
-        standard_regimen = standard.regimens.get(src.upper())
-        grammar_obj = grammar.parse(standard_regimen)
-        data_obj = _parse(grammar_obj)
-        return data_obj
+    if backend is None:
+        backend = _default_backend
+    parser = _get_backend(backend)
+    standard_regimen = standard_index().by_name.get(src.upper())
+    if standard_regimen is not None:
+        return standard_regimen
+    key = (backend, normalize_source(src))
+    return _cache.get(key, lambda: parser(src))
+
+
+Canonicalization = collections.namedtuple(
+    "Canonicalization", ["source", "regimen", "error"]
+)
+
+ParseError = collections.namedtuple(
+    "ParseError", ["type", "msg", "lineno", "offset", "text"]
+)
+ParseError.__doc__ = """Why a regimen couldn't be canonicalized.
+
+`type` is the exception's class and `msg` its message; `lineno`,
+`offset` and `text` are the SyntaxError's position details (or None,
+for other exceptions). Unlike the exception, they survive being sent
+back from a worker process.
+"""
+
+
+def _parse_error(err):
+    if isinstance(err, SyntaxError):
+        msg = err.msg
+    else:
+        msg = str(err)
+    return ParseError(
+        type=type(err),
+        msg=msg,
+        lineno=getattr(err, "lineno", None),
+        offset=getattr(err, "offset", None),
+        text=getattr(err, "text", None),
+    )
+
+
+def _canonicalize_one(src, backend=None):
+    try:
+        return from_string(src, backend=backend), None
+    except Exception as err:
+        return None, _parse_error(err)
+
+
+def canonicalize_many(sources, workers=None, chunksize=None, backend=None):
+    """Canonicalize many regimen strings, in parallel
+
+    Duplicate sources are only parsed once; the unique ones are split
+    into chunks and spread over a pool of `workers` processes (by
+    default, one per CPU; 1 parses in this process). Returns a list of
+    Canonicalization(source, regimen, error) in the same order as the
+    input. If a source can't be parsed, its regimen is None and its
+    error is a ParseError; the rest of the batch is unaffected.
+    """
+    sources = list(sources)
+    unique = list(collections.OrderedDict.fromkeys(sources))
+    if backend is None:
+        backend = _default_backend
+    _get_backend(backend)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    canonicalize = functools.partial(_canonicalize_one, backend=backend)
+    if workers <= 1 or len(unique) <= 1:
+        results = [canonicalize(src) for src in unique]
     else:
-        grammar_obj = grammar.parse(src)
-        data_obj = _parse(grammar_obj)
-        return data_obj
+        if chunksize is None:
+            chunksize = max(1, len(unique) // (workers * 4))
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            results = list(
+                pool.map(canonicalize, unique, chunksize=chunksize)
+            )
+    by_source = dict(zip(unique, results))
+    return [Canonicalization(src, *by_source[src]) for src in sources]
 
 
 def _reg_part(row):
@@ -328,13 +792,60 @@ def _reg_part(row):
 def from_dao(dao, uid):
     if type(uid) is not uuid.UUID:
         uid = uuid.UUID(uid)
+
+    def build():
+        return (
+            dao.regimen.outerjoin(dao.regimendruginclusion)
+            .select()
+            .where(dao.regimen.c.id == sql.bindparam("id"))
+        )
+
+    query = dao.compiled(("regimen", "from_dao"), build)
+    reg_rows = dao.query(query, {"id": uid})
+    return consolidate(map(_reg_part, reg_rows))
+
+
+def from_dao_many(dao, ids=None, batch_size=500):
+    """Rebuild many regimens from the database at once.
+
+    Returns a dict of regimen id to canonical regimen, for the given
+    ids (ids that aren't in the database are left out) or for every
+    regimen if `ids` is None. The rows come from one ordered, streamed
+    query (one per `batch_size` ids, to keep parameter lists short), and
+    are grouped by regimen as they arrive.
+    """
     query = (
         dao.regimen.outerjoin(dao.regimendruginclusion)
         .select()
-        .where(dao.regimen.c.id == uid)
+        .order_by(dao.regimen.c.id)
     )
-    reg_rows = dao.query(query)
-    return consolidate(map(_reg_part, reg_rows))
+    if ids is None:
+        batches = [query]
+    else:
+        ids = [
+            uid if type(uid) is uuid.UUID else uuid.UUID(uid) for uid in ids
+        ]
+        batches = [
+            query.where(dao.regimen.c.id.in_(batch))
+            for batch in util.chunks(ids, batch_size)
+        ]
+    regimens = {}
+    for batch in batches:
+        regimens.update(from_rows(dao.stream(batch)))
+    return regimens
+
+
+def from_rows(rows):
+    """Rebuild regimens from Regimen rows joined to their inclusions.
+
+    The rows have to be grouped by regimen id (e.g. ordered by it), as
+    in `from_dao_many`'s query. Returns a dict of regimen id to
+    canonical regimen.
+    """
+    return {
+        reg_id: consolidate(map(_reg_part, reg_rows))
+        for reg_id, reg_rows in itertools.groupby(rows, lambda row: row.id)
+    }
 
 
 # ---------------------------------------------------------------------
@@ -355,3 +866,141 @@ def drug_inclusions(regimen):
                     frequency=indication.frequency,
                     duration=reg_part.duration,
                 )
+
+
+# ---------------------------------------------------------------------
+# Find Regimens
+
+
+def _amount_text(amount):
+    # Amounts from the database come back as padded Decimals (or floats)
+    return format(decimal.Decimal(str(amount)).normalize(), "f")
+
+
+def canonical_text(regimen):
+    """A normalized text form of a canonical regimen.
+
+    Equal regimens have equal text, however they were written (or
+    loaded from the database): parts, indications and doses are sorted,
+    amounts are normalized and durations are in days. The text can be
+    parsed back into the same regimen with `from_string`.
+    """
+    parts = []
+    for reg_part in regimen:
+        indications = []
+        for indication in reg_part.drug_combination:
+            doses = sorted(
+                "{}mg {}".format(_amount_text(dose.amount), dose.compound)
+                for dose in indication.doselist
+            )
+            indications.append(
+                "({}) {}".format(" + ".join(doses), indication.frequency)
+            )
+        text = " & ".join(sorted(indications))
+        if reg_part.duration is not None:
+            text = "{} {} days".format(text, reg_part.duration)
+        parts.append(text)
+    return ", ".join(sorted(parts)).lower()
+
+
+def regimen_key(regimen):
+    """A stable, content-addressed key for a canonical regimen.
+
+    The key is the SHA-256 of `canonical_text(regimen)` (as hex), so it
+    doesn't change between processes or Python versions. It's stored in
+    Regimen.canonical_key.
+    """
+    text = canonical_text(regimen)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def find_or_create_regimen(dao, src, name=None):
+    """Get the id of a regimen in the database, adding it if needed.
+
+    `src` is regimen text (or a standard regimen's name) that
+    `from_string` can parse, or a canonical regimen. The lookup uses the
+    indexed Regimen.canonical_key, so regimens written differently but
+    meaning the same thing (e.g. "HARVONI" and "(90mg ldv + 400mg sof)
+    qd 12 weeks") get the same id. New regimens are stored with `name`.
+    """
+    regimen = from_string(src) if isinstance(src, str) else src
+    reg_key = regimen_key(regimen)
+    query = dao.statement("regimen", "select", ["canonical_key"])
+    with dao.transaction():
+        existing = next(dao.query(query, {"canonical_key": reg_key}), None)
+        if existing is not None:
+            return existing.id
+        return dao.load_regimens([(name, regimen)])[0]
+
+
+InclusionColumns = collections.namedtuple(
+    "InclusionColumns",
+    ["regimen", "medication_id", "dose", "frequency", "duration"],
+)
+
+
+def _numpy_columns(columns):
+    return InclusionColumns(
+        regimen=numpy.frombuffer(columns.regimen, dtype=numpy.int64),
+        medication_id=numpy.array(columns.medication_id, dtype=str),
+        dose=numpy.frombuffer(columns.dose, dtype=numpy.float64),
+        frequency=numpy.array(columns.frequency, dtype=str),
+        duration=numpy.frombuffer(columns.duration, dtype=numpy.float64),
+    )
+
+
+def inclusion_columns(regimens, use_numpy=None):
+    """The drug inclusions of many regimens, as parallel columns.
+
+    Equivalent to `drug_inclusions` for each regimen, but without a
+    namedtuple per row: returns an InclusionColumns of equal-length
+    columns, where `regimen` is the index of each row's regimen in
+    `regimens`. Doses are floats (in mg) and durations are floats (in
+    days), with NaN for regimen parts without a duration.
+
+    The columns are NumPy arrays if NumPy is installed (or `use_numpy`
+    is True), and otherwise `array.array`s (for numbers) and lists of
+    the (shared) code strings, which pandas and pyarrow both accept.
+    """
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    elif use_numpy and numpy is None:
+        raise ImportError("inclusion_columns(use_numpy=True) needs numpy")
+    columns = InclusionColumns(
+        regimen=array.array("q"),
+        medication_id=[],
+        dose=array.array("d"),
+        frequency=[],
+        duration=array.array("d"),
+    )
+    for idx, regimen in enumerate(regimens):
+        for reg_part in regimen:
+            duration = reg_part.duration
+            duration = math.nan if duration is None else float(duration)
+            for indication in reg_part.drug_combination:
+                frequency = indication.frequency
+                for dose in indication.doselist:
+                    columns.regimen.append(idx)
+                    columns.medication_id.append(dose.compound)
+                    columns.dose.append(float(dose.amount))
+                    columns.frequency.append(frequency)
+                    columns.duration.append(duration)
+    if use_numpy:
+        return _numpy_columns(columns)
+    return columns
+
+
+def inclusion_records(columns, regimen_ids):
+    """RegimenDrugInclusion rows (dicts) from inclusion columns.
+
+    `regimen_ids[i]` is the id of the i'th regimen given to
+    `inclusion_columns`. The rows can go straight to `DAO.bulk_load`.
+    """
+    for idx, medication_id, dose, frequency, duration in zip(*columns):
+        yield {
+            "regimen_id": regimen_ids[idx],
+            "medication_id": str(medication_id),
+            "dose": float(dose),
+            "frequency": str(frequency),
+            "duration": None if math.isnan(duration) else int(duration),
+        }
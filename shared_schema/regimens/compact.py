@@ -0,0 +1,158 @@
+"""A compact, interned representation of canonical regimens
+
+Canonical regimens (from shared_schema.regimens.cannonical) are nested
+frozensets of namedtuples holding Decimals and strings. That's
+convenient, but heavy when there are millions of them in memory. A
+CompactRegimen holds the same information as nested tuples of small
+integers:
+
+- compounds and frequencies are indexes into `grammar._compounds` and
+  `grammar._freqs`
+- amounts are integers, scaled by AMOUNT_SCALE
+- durations are days (or None), as in the canonical form
+
+Everything is sorted, so equal regimens have equal tuples. `compact`
+interns its results (equal regimens share one object while it's in
+use), and hashes are computed once. `expand` (or `to_canonical`) turns
+a CompactRegimen back into an equal canonical regimen.
+"""
+import decimal
+import weakref
+
+from . import cannonical, grammar
+
+AMOUNT_SCALE = 10 ** 6
+
+_compounds = tuple(grammar._compounds)
+_freqs = tuple(grammar._freqs)
+_compound_index = {code: idx for idx, code in enumerate(_compounds)}
+_freq_index = {code: idx for idx, code in enumerate(_freqs)}
+
+
+def _code_index(index, code, kind):
+    try:
+        return index[code]
+    except KeyError:
+        msg = "Can't compact unknown {}: {}"
+        raise ValueError(msg.format(kind, code)) from None
+
+
+def _scaled_amount(amount):
+    scaled = decimal.Decimal(str(amount)) * AMOUNT_SCALE
+    if scaled != scaled.to_integral_value():
+        msg = "Can't compact an amount with more than {} decimal places: {}"
+        raise ValueError(msg.format(len(str(AMOUNT_SCALE)) - 1, amount))
+    return int(scaled)
+
+
+def _amount(scaled):
+    whole, fraction = divmod(scaled, AMOUNT_SCALE)
+    if fraction == 0:
+        return decimal.Decimal(whole)
+    return decimal.Decimal(scaled) / AMOUNT_SCALE
+
+
+def _duration_order(part):
+    duration = part[0]
+    return (duration is not None, duration or 0, part[1])
+
+
+class CompactRegimen(object):
+    """A canonical regimen as sorted tuples of small integers.
+
+    `parts` is a tuple of (duration, indications) pairs, where each
+    indication is a (frequency index, doses) pair and each dose is a
+    (compound index, scaled amount) pair.
+    """
+
+    __slots__ = ("parts", "_hash", "__weakref__")
+
+    def __init__(self, parts):
+        self.parts = parts
+        self._hash = hash(parts)
+
+    @classmethod
+    def from_canonical(cls, regimen):
+        parts = []
+        for reg_part in regimen:
+            indications = []
+            for indication in reg_part.drug_combination:
+                doses = tuple(
+                    sorted(
+                        (
+                            _code_index(
+                                _compound_index, dose.compound, "compound"
+                            ),
+                            _scaled_amount(dose.amount),
+                        )
+                        for dose in indication.doselist
+                    )
+                )
+                freq = _code_index(
+                    _freq_index, indication.frequency, "frequency"
+                )
+                indications.append((freq, doses))
+            parts.append((reg_part.duration, tuple(sorted(indications))))
+        return cls(tuple(sorted(parts, key=_duration_order)))
+
+    def to_canonical(self):
+        return frozenset(
+            cannonical._regimen_part(
+                duration=duration,
+                drug_combination=frozenset(
+                    cannonical._indication(
+                        frequency=_freqs[freq],
+                        doselist=frozenset(
+                            cannonical._dose(
+                                amount=_amount(amount),
+                                compound=_compounds[compound],
+                            )
+                            for compound, amount in doses
+                        ),
+                    )
+                    for freq, doses in indications
+                ),
+            )
+            for duration, indications in self.parts
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactRegimen):
+            return NotImplemented
+        return self is other or (
+            self._hash == other._hash and self.parts == other.parts
+        )
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return "CompactRegimen({!r})".format(self.parts)
+
+    def __reduce__(self):
+        return (compact_parts, (self.parts,))
+
+
+_interned = weakref.WeakValueDictionary()
+
+
+def compact_parts(parts):
+    "Get the interned CompactRegimen for a `parts` tuple"
+    regimen = _interned.get(parts)
+    if regimen is None:
+        regimen = _interned.setdefault(parts, CompactRegimen(parts))
+    return regimen
+
+
+def compact(regimen):
+    """Get the interned CompactRegimen for a canonical regimen.
+
+    Raises ValueError for compounds or frequencies the grammar doesn't
+    know, and for amounts that can't be scaled to integers.
+    """
+    return compact_parts(CompactRegimen.from_canonical(regimen).parts)
+
+
+def expand(compact_regimen):
+    "Get the canonical (namedtuple) form of a CompactRegimen"
+    return compact_regimen.to_canonical()
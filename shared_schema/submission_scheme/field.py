@@ -10,17 +10,18 @@ changing some of its properties in the process.
 
 from typing import List, Tuple
 
-from shared_schema import datatypes, util
+from shared_schema import datatypes
 
 
 def _possible_values(schema_field_type: str) -> List[str]:
     """The possible values of a schema field's corresponding submission
     scheme field.
     """
-    if not datatypes.classify(schema_field_type) is datatypes.Datatype.ENUM:
+    parsed = datatypes.parse(schema_field_type)
+    if parsed.datatype is not datatypes.Datatype.ENUM:
         return []
     else:
-        return list(util.enum_members(schema_field_type))
+        return list(parsed.members)
 
 
 def _get_scheme_field_type(schema_field_type: datatypes.Datatype) -> str:
@@ -50,12 +51,14 @@ class Field(object):
         descr: str = None,
         req: bool = False,
         possible_values: str = None,
+        value_range: Tuple[float, float] = None,
     ) -> None:
         self.schema_type = schema_type
         self.name = name
         self.description = descr
         self._possible_values = possible_values
         self.required = req
+        self.value_range = value_range
         if schema_path is None:
             msg = "Missing schema_path for field '{}'"
             raise TypeError(msg.format(name))
@@ -67,7 +70,7 @@ class Field(object):
 
     @property
     def type(self) -> datatypes.Datatype:
-        return datatypes.classify(self.schema_type)
+        return datatypes.parse(self.schema_type).datatype
 
     @property
     def possible_values(self) -> str:
@@ -87,6 +90,7 @@ class Field(object):
         new_name=None,
         new_possible_values=None,
         schema_path=None,
+        value_range=None,
     ):
         def or_default(item, default):
             if item is not None:
@@ -101,4 +105,5 @@ class Field(object):
             req=req,
             descr=or_default(new_descr, schema_field.description),
             possible_values=or_default(new_possible_values, None),
+            value_range=value_range,
         )
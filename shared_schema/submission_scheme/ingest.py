@@ -0,0 +1,425 @@
+"""Streaming ingest of CSV files in the simple submission scheme
+
+A simple-scheme CSV has one row per participant and sample kind (see
+`simple.scheme`). `ingest` reads one in chunks of `chunk_size` rows, so
+memory use doesn't grow with the size of the file:
+
+1. Each chunk is parsed: its columns are checked with
+   `validate.validate_columns`, values are coerced to their schema
+   types and the regimen columns are canonicalized. Chunks are parsed
+   in a pool of worker processes, with a few chunks in flight at once.
+2. Valid rows are mapped through each field's `schema_path` into rows
+   of Person, Case, BehaviorData, LossToFollowUp, TreatmentData,
+   ClinicalData and (for rows with a `seq_id`) Isolate, ClinicalIsolate
+   and Sequence, and each chunk is bulk loaded through the DAO in one
+   transaction.
+
+Participants are matched to existing Cases (by `id` and study) in the
+database, so a participant's later rows only add ClinicalData and
+sequences. The Person, Case, BehaviorData, LossToFollowUp and
+TreatmentData rows come from a participant's first row. Regimens are
+found or created by their canonical key (see
+`regimens.cannonical.find_or_create_regimen`).
+"""
+
+import collections
+import concurrent.futures
+import csv
+import functools
+import os
+import uuid
+
+import sqlalchemy as sa
+
+from shared_schema import data, regimens, util, validation
+
+from . import simple, validate
+
+REGIMEN_FIELDS = ("regimen", "prev_regimen", "pprev_regimen")
+
+# Entities in the order they're loaded (referenced entities first)
+ENTITIES = (
+    "Person",
+    "Case",
+    "BehaviorData",
+    "LossToFollowUp",
+    "TreatmentData",
+    "ClinicalData",
+    "Isolate",
+    "ClinicalIsolate",
+    "Sequence",
+)
+
+IngestReport = collections.namedtuple(
+    "IngestReport", ["rows", "loaded", "invalid", "errors"]
+)
+IngestReport.__doc__ = """The outcome of an ingest.
+
+`rows` is the number of data rows read, `loaded` maps entity names to
+the number of rows loaded, `invalid` is the number of rows that were
+skipped, and `errors` lists (up to `max_errors`) validation.RowErrors
+for them, numbered from 0 for the first data row.
+"""
+
+_parsed_chunk = collections.namedtuple(
+    "parsed_chunk", ["start", "size", "records", "regimens", "errors"]
+)
+_parsed_chunk.__qualname__ = "_parsed_chunk"
+
+_FIELDS = {fld.name: fld for fld in simple.fields}
+
+
+def _entity_fields():
+    "The simple scheme's fields that map to each entity's fields"
+    result = collections.defaultdict(list)
+    for fld in simple.fields:
+        if isinstance(fld.schema_path, tuple):
+            entity_name, field_name = fld.schema_path
+            result[entity_name].append((fld.name, field_name))
+    return dict(result)
+
+
+_ENTITY_FIELDS = _entity_fields()
+
+
+def _members(entity_name, field_name):
+    fld = data.schema_data.find_field(entity_name, field_name)
+    return fld.parsed_type.members
+
+
+_SAMPLE_KINDS = _members("ClinicalIsolate", "sample_kind")
+_SEQ_METHODS = _members("Sequence", "seq_method")
+
+
+def _coercers():
+    result = {}
+    for fld in simple.fields:
+        coerce, expected = validation.coercer(
+            data.schema_data, fld.schema_type
+        )
+        if fld.value_range is not None:
+            expected = "{} from {} to {}".format(expected, *fld.value_range)
+        result[fld.name] = (coerce, expected)
+    return result
+
+
+_COERCERS = _coercers()
+
+
+def _is_blank(value):
+    return value is None or value.strip() == ""
+
+
+def _converted(name, value):
+    "A submitted value, coerced (or None, for blanks and bad values)"
+    if _is_blank(value):
+        return None
+    if name in REGIMEN_FIELDS:
+        return value.strip()
+    try:
+        return _COERCERS[name][0](value)
+    except (ValueError, TypeError):
+        return None
+
+
+def _parse_chunk(header, start, rows):
+    """Validate and coerce a chunk of CSV rows.
+
+    Returns a _parsed_chunk with a (row index, record) pair for each
+    valid row, the canonical regimens of the chunk's regimen texts (or
+    None, for texts that don't parse), and RowErrors for the rest.
+    """
+    errors = []
+    width = len(header)
+    for offset, row in enumerate(rows):
+        if len(row) != width:
+            msg = "Expected {} values, got {}".format(width, len(row))
+            errors.append(validation.RowError(start + offset, None, row, msg))
+    columns = {
+        name: [row[idx] if idx < len(row) else "" for row in rows]
+        for idx, name in enumerate(header)
+        if name in _FIELDS
+    }
+    masks = validate.validate_columns(simple.fields, columns)
+    for name, mask in masks.items():
+        expected = _COERCERS[name][1]
+        for offset in validate.invalid_rows({name: mask}):
+            value = columns[name][offset] if name in columns else None
+            msg = "Required" if _is_blank(value) else "Expected " + expected
+            errors.append(
+                validation.RowError(start + offset, name, value, msg)
+            )
+    texts = {
+        value.strip()
+        for name in REGIMEN_FIELDS
+        for value in set(columns.get(name, ()))
+    }
+    texts.discard("")
+    canonical = {
+        result.source: result.regimen
+        for result in regimens.cannonical.canonicalize_many(texts, workers=1)
+    }
+    bad_rows = {err.row - start for err in errors}
+    for name in REGIMEN_FIELDS:
+        for offset, value in enumerate(columns.get(name, ())):
+            value = value.strip()
+            if value and canonical[value] is None and offset not in bad_rows:
+                msg = "Can't parse regimen"
+                errors.append(
+                    validation.RowError(start + offset, name, value, msg)
+                )
+                bad_rows.add(offset)
+    # NOTE: Columns have few distinct values, so each one is converted
+    # once. Values that don't convert are only in rows with errors.
+    names = list(columns)
+    converted = []
+    for name in names:
+        values = columns[name]
+        conversions = {
+            value: _converted(name, value) for value in set(values)
+        }
+        converted.append(map(conversions.__getitem__, values))
+    records = [
+        (start + offset, dict(zip(names, row_values)))
+        for offset, row_values in enumerate(zip(*converted))
+        if offset not in bad_rows
+    ]
+    errors.sort(key=lambda err: err.row)
+    return _parsed_chunk(start, len(rows), records, canonical, errors)
+
+
+def _bounded_map(pool, func, items, window):
+    "Like pool.map, in order, but with at most `window` items in flight"
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.submit(func, *item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def parsed_chunks(csvfile, chunk_size=10000, workers=None):
+    """Read and parse a simple-scheme CSV file in chunks.
+
+    `csvfile` is an open file (opened with `newline=""`) or any
+    iterable of lines. Yields _parsed_chunks in order; with more than
+    one worker, chunks are parsed in a process pool.
+    """
+    reader = csv.reader(csvfile)
+    header = [name.strip() for name in next(reader, [])]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    parse = functools.partial(_parse_chunk, header)
+    chunks = (
+        (idx * chunk_size, rows)
+        for idx, rows in enumerate(util.chunks(reader, chunk_size))
+    )
+    if workers <= 1:
+        yield from (parse(start, rows) for start, rows in chunks)
+        return
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        yield from _bounded_map(pool, parse, chunks, workers * 2)
+
+
+def _fields_of(entity_name, record):
+    "The values of a record's fields that map to an entity's fields"
+    return {
+        field_name: record.get(name)
+        for name, field_name in _ENTITY_FIELDS.get(entity_name, ())
+    }
+
+
+class _Loader(object):
+    "Turns parsed chunks into entity rows, and loads them"
+
+    # NOTE: Regimen ids are cached by canonical key; there are few
+    # distinct regimens, but the cache is bounded anyway.
+    MAX_CACHED_REGIMENS = 10000
+
+    def __init__(self, dao, study_name, sequences):
+        self.dao = dao
+        self.study_name = study_name
+        self.sequences = sequences
+        self.regimen_ids = collections.OrderedDict()
+
+    def regimen_id(self, text, regimen):
+        key = regimens.cannonical.regimen_key(regimen)
+        reg_id = self.regimen_ids.get(key)
+        if reg_id is None:
+            find_or_create = regimens.cannonical.find_or_create_regimen
+            reg_id = find_or_create(self.dao, regimen, name=text)
+            self.regimen_ids[key] = reg_id
+            if len(self.regimen_ids) > self.MAX_CACHED_REGIMENS:
+                self.regimen_ids.popitem(last=False)
+        return reg_id
+
+    def existing_cases(self, participant_ids):
+        case = self.dao.case
+        if self.study_name is None:
+            same_study = case.c.study_name.is_(None)
+        else:
+            same_study = case.c.study_name == self.study_name
+        found = {}
+        for batch in util.chunks(sorted(participant_ids), 500):
+            query = sa.select(
+                [case.c.study_participant_id, case.c.id]
+            ).where(
+                sa.and_(case.c.study_participant_id.in_(batch), same_study)
+            )
+            for row in self.dao.query(query):
+                found[row.study_participant_id] = row.id
+        return found
+
+    def new_case(self, rows, record, canonical):
+        person = dict(_fields_of("Person", record), id=uuid.uuid4())
+        case = dict(
+            _fields_of("Case", record),
+            id=uuid.uuid4(),
+            person_id=person["id"],
+            study_name=self.study_name,
+        )
+        rows["Person"].append(person)
+        rows["Case"].append(case)
+        rows["BehaviorData"].append(
+            dict(
+                _fields_of("BehaviorData", record),
+                id=uuid.uuid4(),
+                case_id=case["id"],
+            )
+        )
+        ltfu = _fields_of("LossToFollowUp", record)
+        if record.get("ltfu") or any(v is not None for v in ltfu.values()):
+            ltfu["case_id"] = case["id"]
+            rows["LossToFollowUp"].append(ltfu)
+        treatment = dict(
+            _fields_of("TreatmentData", record),
+            id=uuid.uuid4(),
+            case_id=case["id"],
+        )
+        for name in REGIMEN_FIELDS:
+            text = record.get(name)
+            reg_id = None
+            if text is not None:
+                reg_id = self.regimen_id(text, canonical[text])
+            treatment[name + "_id"] = reg_id
+        rows["TreatmentData"].append(treatment)
+        return case["id"]
+
+    def sequence_problem(self, record):
+        "A (field, value, message) problem with a row's sequence, if any"
+        seq_id = record["seq_id"]
+        if self.sequences is None or seq_id not in self.sequences:
+            return "seq_id", seq_id, "Unknown sequence"
+        seq_method = record.get("seq_method")
+        if (seq_method or "").strip().lower() not in _SEQ_METHODS:
+            msg = "Expected one of: {}".format(", ".join(_SEQ_METHODS))
+            return "seq_method", seq_method, msg
+        return None
+
+    def add_sequence(self, rows, case_id, record):
+        isolate_id = uuid.uuid4()
+        sample_kind = record.get("seq_kind")
+        rows["Isolate"].append({"id": isolate_id, "type": "clinical"})
+        rows["ClinicalIsolate"].append(
+            {
+                "isolate_id": isolate_id,
+                "case_id": case_id,
+                "sample_kind": (
+                    sample_kind if sample_kind in _SAMPLE_KINDS else None
+                ),
+            }
+        )
+        rows["Sequence"].append(
+            {
+                "id": uuid.uuid4(),
+                "isolate_id": isolate_id,
+                "genotype": record.get("genotype"),
+                "subgenotype": record.get("subgenotype"),
+                "strain": record.get("strain"),
+                "seq_method": record["seq_method"].strip().lower(),
+                "cutoff": record.get("cutoff"),
+                "raw_nt_seq": self.sequences[record["seq_id"]],
+                "notes": record.get("seq_notes"),
+            }
+        )
+
+    def load(self, chunk):
+        "Load a parsed chunk; returns (rows loaded by entity, errors)"
+        errors = []
+        rows = {name: [] for name in ENTITIES}
+        with self.dao.transaction():
+            case_ids = self.existing_cases(
+                {record["id"] for _, record in chunk.records}
+            )
+            for index, record in chunk.records:
+                seq_id = record.get("seq_id")
+                problem = None
+                if seq_id is not None:
+                    problem = self.sequence_problem(record)
+                if problem is not None:
+                    errors.append(validation.RowError(index, *problem))
+                    continue
+                case_id = case_ids.get(record["id"])
+                if case_id is None:
+                    case_id = self.new_case(rows, record, chunk.regimens)
+                    case_ids[record["id"]] = case_id
+                rows["ClinicalData"].append(
+                    dict(
+                        _fields_of("ClinicalData", record),
+                        id=uuid.uuid4(),
+                        case_id=case_id,
+                        kind=record.get("kind"),
+                    )
+                )
+                if seq_id is not None:
+                    self.add_sequence(rows, case_id, record)
+            loaded = {}
+            for name in ENTITIES:
+                if rows[name]:
+                    loaded[name] = self.dao.bulk_load(name, rows[name])
+        return loaded, errors
+
+
+def ingest(
+    dao,
+    csvfile,
+    study_name=None,
+    sequences=None,
+    chunk_size=10000,
+    workers=None,
+    max_errors=1000,
+):
+    """Load a simple-scheme CSV file into the database.
+
+    Arguments:
+    - dao           a shared_schema.dao.DAO (with its tables created)
+    - csvfile       an open file (with `newline=""`) or iterable of lines
+    - study_name    the SourceStudy the participants belong to (created
+                    if it doesn't exist)
+    - sequences     a mapping of `seq_id`s to nucleotide sequences (e.g.
+                    read from the submission's FASTA files)
+    - chunk_size    how many rows are parsed and loaded at a time
+    - workers       how many processes parse chunks (by default, one per
+                    CPU; 1 parses in this process)
+    - max_errors    how many RowErrors to keep in the report
+
+    Invalid rows are skipped. Each chunk is loaded in its own
+    transaction, so the chunks before an unexpected database error stay
+    loaded. Returns an IngestReport.
+    """
+    if study_name is not None:
+        dao.insert_or_check_identical("sourcestudy", {"name": study_name})
+    loader = _Loader(dao, study_name, sequences)
+    num_rows = 0
+    invalid = 0
+    loaded = collections.Counter()
+    errors = []
+    for chunk in parsed_chunks(csvfile, chunk_size, workers):
+        chunk_loaded, load_errors = loader.load(chunk)
+        loaded.update(chunk_loaded)
+        chunk_errors = chunk.errors + load_errors
+        num_rows += chunk.size
+        invalid += len({err.row for err in chunk_errors})
+        errors.extend(chunk_errors[: max(0, max_errors - len(errors))])
+    return IngestReport(num_rows, dict(loaded), invalid, errors)
@@ -182,6 +182,7 @@ scheme = {
                 "sequence; 5% should be entered as '5' or '5.0'."
             ),
             schema_path="not applicable",
+            value_range=(0, 100),
         ),
         field(
             "seq_notes",
@@ -0,0 +1,149 @@
+"""Column-at-a-time validation of submitted data
+
+Submissions following the submission scheme are large CSV files, so
+rather than checking them row by row, `validate_columns` checks whole
+columns of (string) values against the scheme's Fields: required
+values, enum members (from each field's schema type), numbers (and
+each field's `value_range`), dates and booleans.
+
+Submitted columns have few distinct values (enums, booleans, years,
+dates), so each distinct value is checked once, with the same coercers
+as shared_schema.validation, and the column's error mask is built from
+the set of bad values in one pass. With NumPy installed, the masks are
+NumPy bool arrays, and number columns with many distinct values (and
+no blanks) are converted and range-checked as arrays instead.
+
+The result maps each field's name to an error mask: a NumPy bool array
+(or a bytearray, without NumPy) that's true for the rows where the
+field's value is invalid.
+"""
+
+from shared_schema import data, datatypes, validation
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+Datatype = datatypes.Datatype
+
+_NUMBER_TYPES = {Datatype.INTEGER: "int64", Datatype.FLOAT: "float64"}
+_MAX_DISTINCT_FRACTION = 8
+
+
+def _is_blank(value):
+    return value is None or value.strip() == ""
+
+
+def _value_check(fld):
+    "A function that tells whether one of a field's values is valid"
+    coerce, _ = validation.coercer(data.schema_data, fld.schema_type)
+    value_range = fld.value_range
+
+    def is_valid(value):
+        if _is_blank(value):
+            return not fld.required
+        try:
+            coerced = coerce(value)
+        except (ValueError, TypeError):
+            return False
+        if value_range is not None:
+            low, high = value_range
+            return low <= coerced <= high
+        return True
+
+    return is_valid
+
+
+def _numpy_number_mask(fld, values):
+    """Check a column of numbers as a NumPy array.
+
+    The column mustn't have blanks (NumPy would turn None into NaN).
+    Returns None if the column doesn't convert.
+    """
+    try:
+        converted = numpy.array(values, dtype=_NUMBER_TYPES[fld.type])
+    except (ValueError, TypeError, OverflowError):
+        return None
+    invalid = numpy.zeros(converted.shape, dtype=bool)
+    if fld.type is Datatype.FLOAT:
+        invalid |= ~numpy.isfinite(converted)
+    if fld.value_range is not None:
+        low, high = fld.value_range
+        invalid |= (converted < low) | (converted > high)
+    return invalid
+
+
+def column_mask(fld, values, use_numpy=None):
+    "The error mask for a column of a Field's values"
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    distinct = set(values)
+    if use_numpy and fld.type in _NUMBER_TYPES:
+        # NOTE: Converting to an array only pays off when there are too
+        # many distinct values to check one at a time. Blanks are left
+        # to the per-value check, which knows whether they're required.
+        many_distinct = len(distinct) > len(values) // _MAX_DISTINCT_FRACTION
+        if many_distinct and not any(map(_is_blank, distinct)):
+            invalid = _numpy_number_mask(fld, values)
+            if invalid is not None:
+                return invalid
+    is_valid = _value_check(fld)
+    bad = {value for value in distinct if not is_valid(value)}
+    if use_numpy:
+        if not bad:
+            return numpy.zeros(len(values), dtype=bool)
+        return numpy.fromiter(
+            map(bad.__contains__, values), dtype=bool, count=len(values)
+        )
+    if not bad:
+        return bytearray(len(values))
+    return bytearray(map(bad.__contains__, values))
+
+
+def validate_columns(fields, columns, use_numpy=None):
+    """Check columns of submitted values against submission scheme Fields.
+
+    `columns` maps field names to equal-length sequences of strings.
+    Blank values (None, "" or only whitespace) are missing, whatever the
+    field's type. A field without a column counts as all
+    blank. Columns that don't match a field are ignored. Returns a dict
+    of error masks by field name (see the module docstring).
+    """
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    elif use_numpy and numpy is None:
+        raise ImportError("validate_columns(use_numpy=True) needs numpy")
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        msg = "Columns have different lengths: {}"
+        raise ValueError(msg.format(sorted(lengths)))
+    num_rows = lengths.pop() if lengths else 0
+    masks = {}
+    for fld in fields:
+        values = columns.get(fld.name)
+        if values is None:
+            values = [None] * num_rows
+        masks[fld.name] = column_mask(fld, values, use_numpy)
+    return masks
+
+
+def invalid_rows(masks):
+    "The (sorted) indexes of rows with an error in any column"
+    if not masks:
+        return []
+    if numpy is not None and any(
+        isinstance(mask, numpy.ndarray) for mask in masks.values()
+    ):
+        combined = numpy.logical_or.reduce(
+            [numpy.asarray(mask, dtype=bool) for mask in masks.values()]
+        )
+        return numpy.flatnonzero(combined).tolist()
+    return sorted(
+        {
+            idx
+            for mask in masks.values()
+            for idx, bad in enumerate(mask)
+            if bad
+        }
+    )
@@ -7,8 +7,9 @@ An Entity contains many fields, and represents a database table.
 A Schema contains many entities, and can check things like foreign keys."""
 
 import collections
+import types
 
-from . import datatypes, util
+from . import datatypes, validation
 
 _entity = collections.namedtuple(
     "entity", ["name", "description", "fields", "meta"]
@@ -31,6 +32,18 @@ class Entity(_entity):
                 if fld is None:
                     msg = "Meta contains a Primary Key that isn't a field: {}"
                     raise UserWarning(msg.format(pk))
+        field_names = {fld.name for fld in fields}
+        for index_name, spec in meta.get("indexes", {}).items():
+            spec = (spec,) if isinstance(spec, str) else spec
+            for column in spec:
+                if column not in field_names:
+                    msg = "Index {} contains a column that isn't a field: {}"
+                    raise UserWarning(msg.format(index_name, column))
+        constraint_names = meta.get("constraints", {}).keys()
+        for check_name in meta.get("row checks", {}):
+            if check_name not in constraint_names:
+                msg = "Row check {} doesn't match a constraint"
+                raise UserWarning(msg.format(check_name))
         return cls(name, description, fields, meta)
 
     @property
@@ -68,22 +81,66 @@ class Field(_field):
     def nullable(self):
         return "required" not in self.tags
 
+    @property
+    def parsed_type(self):
+        "The field's type as a datatypes.FieldType"
+        return datatypes.parse(self.type)
+
 
 field = Field.make
 
 
+ForeignKey = collections.namedtuple(
+    "ForeignKey", ["source", "field", "target"]
+)
+
+
 class Schema(object):
-    "A collection of related Entitites with some validity checks"
+    """A collection of related Entitites with some validity checks
+
+    Lookups are indexed once, when the schema is created:
+
+    - `fields` maps (entity name, field name) to the Field
+    - `datatypes` maps (entity name, field name) to the field's
+      classified datatypes.Datatype
+    - `foreign_keys` lists every ForeignKey(source, field, target)
+    - `references` maps an entity name to the foreign keys that refer
+      to it
+    """
 
     def __init__(self, raw_entities):
         self.raw_entities = raw_entities
         self.entities = {e.name: e for e in raw_entities}
         err_msg = "Duplicate entities?"
         assert len(self.entities) == len(self.raw_entities), err_msg
-        types = (f.type for e in self.entities.values() for f in e.fields)
-        for t in types:
-            err_msg = "invalid type: {}".format(t)
-            assert self.type_is_valid(t, self.entities), err_msg
+        fields = {}
+        field_datatypes = {}
+        foreign_keys = []
+        for entity in self.entities.values():
+            for fld in entity.fields:
+                err_msg = "invalid type: {}".format(fld.type)
+                assert self.type_is_valid(fld.type, self.entities), err_msg
+                path = (entity.name, fld.name)
+                fields[path] = fld
+                parsed = fld.parsed_type
+                field_datatypes[path] = parsed.datatype
+                if parsed.datatype is datatypes.Datatype.FOREIGN_KEY:
+                    foreign_keys.append(
+                        ForeignKey(entity.name, fld.name, parsed.target)
+                    )
+        references = collections.defaultdict(list)
+        for fk in foreign_keys:
+            references[fk.target].append(fk)
+        self.fields = types.MappingProxyType(fields)
+        self.datatypes = types.MappingProxyType(field_datatypes)
+        self.foreign_keys = tuple(foreign_keys)
+        self.references = types.MappingProxyType(
+            {target: tuple(fks) for target, fks in references.items()}
+        )
+        self._relationships = frozenset(
+            (fk.source, fk.target) for fk in foreign_keys
+        )
+        self._validators = {}
 
     def get_entity(self, entity_name):
         entity = self.entities.get(entity_name)
@@ -94,24 +151,17 @@ class Schema(object):
 
     @property
     def relationships(self):
-        rels = set()
-        for _, entity in self.entities.items():
-            types = (f.type for f in entity.fields)
-            foreign_keys = [t for t in types if "foreign key" in t]
-            targets = [util.foreign_key_target(f) for f in foreign_keys]
-            for target in targets:
-                rel = (entity.name, target)
-                rels.add(rel)
-        return rels
+        "(source, target) entity name pairs for every foreign key"
+        return self._relationships
 
     @classmethod
     def type_is_valid(cls, t, entities):
         try:
-            datatype = datatypes.classify(t)
+            parsed = datatypes.parse(t)
         except ValueError:
             return False
-        if datatype == datatypes.Datatype.FOREIGN_KEY:
-            fk_target = util.foreign_key_target(t)
+        if parsed.datatype == datatypes.Datatype.FOREIGN_KEY:
+            fk_target = parsed.target
             err_msg = "invalid foreign key target: {}".format(fk_target)
             assert fk_target in entities, err_msg
             return True
@@ -119,13 +169,24 @@ class Schema(object):
             return True
 
     def find_field(self, entity_name, field_name):
-        entity = self.get_entity(entity_name)
-        field = next((f for f in entity.fields if f.name == field_name), None)
+        field = self.fields.get((entity_name, field_name))
         if field is None:
+            self.get_entity(entity_name)
             msg = "No field called '{}' on entity {}"
             raise KeyError(msg.format(field_name, entity_name))
         return field
 
+    def validator(self, entity_name):
+        """A validation.EntityValidator for an entity's records.
+
+        Validators are compiled the first time they're asked for.
+        """
+        validator = self._validators.get(entity_name)
+        if validator is None:
+            validator = validation.EntityValidator(self, entity_name)
+            self._validators[entity_name] = validator
+        return validator
+
     def primary_key_of(self, entity_name):
         entity = self.get_entity(entity_name)
         return entity.meta["primary key"]
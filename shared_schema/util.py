@@ -1,5 +1,6 @@
 """Common utility functions"""
 
+import itertools
 import re
 
 
@@ -13,3 +14,15 @@ def enum_members(field_type):
     "The members of an ENUM type field (from the field's type)"
     matches = re.findall(r"enum\s*\((.+)\)", field_type)
     return (member.strip().lower() for member in matches[0].split(","))
+
+
+def chunks(iterable, size):
+    "Split an iterable into lists of (at most) `size` items"
+    if size < 1:
+        raise ValueError("Chunk size must be at least 1")
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,252 @@
+"""Validating records against the schema, without a database
+
+An EntityValidator is compiled once per entity (usually through
+`Schema.validator`), with each field's type coercer, enum members and
+required flag worked out in advance. It checks batches of dicts (e.g.
+the rows of a submission, before they go to DAO.insert_many) and
+reports every problem in every row, rather than stopping at the first.
+
+Entity check constraints are SQL, so each one needs a Python version
+in the entity's metadata ("row checks", by constraint name); it's
+called with the coerced row once the row's fields are valid. Rows of an
+entity with a constraint that has no row check are reported, since the
+validator can't vouch for them.
+
+Values can already have their Python types (int, Decimal, date, UUID,
+...) or be strings, as read from a CSV file; strings are coerced. An
+empty string counts as a missing value, except in string fields.
+"""
+
+import collections
+import datetime
+import decimal
+import uuid
+
+from . import datatypes
+
+Datatype = datatypes.Datatype
+
+RowError = collections.namedtuple(
+    "RowError", ["row", "field", "value", "message"]
+)
+RowError.__doc__ = """A problem with one field of one row.
+
+`row` is the row's index in the batch (plus the batch's `start`), and
+`field` is None for problems with the whole row.
+"""
+
+Validated = collections.namedtuple("Validated", ["rows", "errors"])
+Validated.__doc__ = """The result of validating a batch of rows.
+
+`rows` holds the coerced copies of the rows without errors, and
+`errors` lists a RowError for each problem in the other rows.
+"""
+
+
+def _integer(value):
+    if type(value) is int:
+        return value
+    if isinstance(value, str):
+        return int(value)
+    raise ValueError(value)
+
+
+def _float(value):
+    if isinstance(value, (float, decimal.Decimal)):
+        return value
+    if isinstance(value, str):
+        try:
+            value = decimal.Decimal(value.strip())
+        except decimal.InvalidOperation:
+            raise ValueError(value) from None
+        if not value.is_finite():
+            raise ValueError(value)
+        return value
+    if type(value) is int:
+        return value
+    raise ValueError(value)
+
+
+def _string(value):
+    if isinstance(value, str):
+        return value
+    raise ValueError(value)
+
+
+def _date(value):
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, str):
+        return datetime.datetime.strptime(value.strip(), "%Y-%m-%d").date()
+    raise ValueError(value)
+
+
+def _uuid(value):
+    if isinstance(value, uuid.UUID):
+        return value
+    if isinstance(value, str):
+        return uuid.UUID(value)
+    raise ValueError(value)
+
+
+_BOOLEANS = {
+    "true": True,
+    "t": True,
+    "yes": True,
+    "1": True,
+    "false": False,
+    "f": False,
+    "no": False,
+    "0": False,
+}
+
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        result = _BOOLEANS.get(value.strip().lower())
+        if result is not None:
+            return result
+    raise ValueError(value)
+
+
+_COERCERS = {
+    Datatype.INTEGER: (_integer, "an integer"),
+    Datatype.FLOAT: (_float, "a number"),
+    Datatype.STRING: (_string, "a string"),
+    Datatype.DATE: (_date, "a date (YYYY-MM-DD)"),
+    Datatype.UUID: (_uuid, "a UUID"),
+    Datatype.BOOL: (_bool, "true or false"),
+}
+
+
+def _enum(members):
+    allowed = frozenset(members)
+
+    def coerce(value):
+        if value in allowed:
+            return value
+        if isinstance(value, str):
+            normed = value.strip().lower()
+            if normed in allowed:
+                return normed
+        raise ValueError(value)
+
+    return coerce, "one of: {}".format(", ".join(members))
+
+
+def coercer(schema, field_type):
+    """A (coerce, expected) pair for a field type.
+
+    `coerce(value)` returns the value with the field's Python type, or
+    raises ValueError (or TypeError); `expected` describes
+    valid values for error messages. Foreign keys are coerced as their
+    target's primary key.
+    """
+    parsed = datatypes.parse(field_type)
+    if parsed.datatype in _COERCERS:
+        return _COERCERS[parsed.datatype]
+    if parsed.datatype is Datatype.ENUM:
+        return _enum(parsed.members)
+    if parsed.datatype is Datatype.FOREIGN_KEY:
+        target_pk = schema.primary_key_of(parsed.target)
+        if not isinstance(target_pk, str):
+            msg = "Can't validate a foreign key to a compound key: {}"
+            raise ValueError(msg.format(field_type))
+        target_field = schema.find_field(parsed.target, target_pk)
+        return coercer(schema, target_field.type)
+    msg = "Can't validate values of type '{}'"
+    raise ValueError(msg.format(field_type))
+
+
+_check = collections.namedtuple(
+    "check", ["coerce", "expected", "required", "blank_is_missing"]
+)
+
+
+class EntityValidator(object):
+    """Validates and coerces rows (dicts) for one entity.
+
+    Call the validator with an iterable of rows to get a Validated
+    result. `start` is added to row indexes, for numbering rows across
+    several batches.
+    """
+
+    def __init__(self, schema, entity_name):
+        entity = schema.get_entity(entity_name)
+        self.entity_name = entity.name
+        self._checks = {}
+        for fld in entity.fields:
+            coerce, expected = coercer(schema, fld.type)
+            datatype = fld.parsed_type.datatype
+            blank_is_missing = datatype is not Datatype.STRING
+            self._checks[fld.name] = _check(
+                coerce, expected, not fld.nullable, blank_is_missing
+            )
+        self.required = frozenset(
+            name for name, check in self._checks.items() if check.required
+        )
+        row_checks = entity.meta.get("row checks", {})
+        self._row_checks = [
+            (name, row_checks.get(name))
+            for name in sorted(entity.meta.get("constraints", {}))
+        ]
+
+    def check_row(self, row):
+        """Coerce one row.
+
+        Returns the coerced copy and a list of (field, value, message)
+        problems. Constraint problems have no field, and the row as
+        their value.
+        """
+        coerced = {}
+        problems = []
+        checks = self._checks
+        for name, value in row.items():
+            check = checks.get(name)
+            if check is None:
+                msg = "Not a field of {}".format(self.entity_name)
+                problems.append((name, value, msg))
+                continue
+            coerce, expected, required, blank_is_missing = check
+            if value is None or (value == "" and blank_is_missing):
+                if required:
+                    problems.append((name, value, "Required"))
+                coerced[name] = None
+                continue
+            try:
+                coerced[name] = coerce(value)
+            except (ValueError, TypeError):
+                msg = "Expected {}".format(expected)
+                problems.append((name, value, msg))
+        if not self.required <= row.keys():
+            for name in sorted(self.required.difference(row)):
+                problems.append((name, None, "Required"))
+        if not problems:
+            for name, row_check in self._row_checks:
+                if row_check is None:
+                    msg = "Can't check constraint {}".format(name)
+                    problems.append((None, row, msg))
+                elif not row_check(coerced):
+                    msg = "Violates constraint {}".format(name)
+                    problems.append((None, row, msg))
+        return coerced, problems
+
+    def __call__(self, rows, start=0):
+        valid = []
+        errors = []
+        check_row = self.check_row
+        for index, row in enumerate(rows, start):
+            if not isinstance(row, dict):
+                errors.append(RowError(index, None, row, "Not a dict"))
+                continue
+            coerced, problems = check_row(row)
+            if problems:
+                errors.extend(
+                    RowError(index, name, value, msg)
+                    for name, value, msg in problems
+                )
+            else:
+                valid.append(coerced)
+        return Validated(valid, errors)
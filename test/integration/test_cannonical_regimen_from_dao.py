@@ -1,5 +1,8 @@
 import tempfile
 import unittest
+import uuid
+
+import sqlalchemy as sa
 
 import shared_schema.dao
 import shared_schema.regimens
@@ -28,3 +31,50 @@ class TestCannonicalRegimenFromDao(unittest.TestCase):
         )
         for reg in regimens:
             self.verify_that_standard_matches_loaded(dao, reg.name, reg.id)
+
+    def test_from_dao_many_matches_from_dao(self):
+        dao = self.new_initialized_dao()
+        empty_id = dao.load_regimens([("empty", frozenset())])[0]
+        ids = [reg.id for reg in dao.query(dao.regimen.select())]
+        from_dao_many = shared_schema.regimens.cannonical.from_dao_many
+        everything = from_dao_many(dao)
+        self.assertEqual(set(everything), set(ids))
+        for reg_id in ids:
+            self.assertEqual(
+                everything[reg_id],
+                shared_schema.regimens.cannonical.from_dao(dao, reg_id),
+            )
+        self.assertIn(empty_id, everything)
+
+        missing = uuid.uuid4()
+        some = from_dao_many(dao, [str(ids[0]), ids[1], missing], 2)
+        self.assertEqual(some, {i: everything[i] for i in ids[:2]})
+
+    def test_find_or_create_regimen(self):
+        dao = self.new_initialized_dao()
+        cannonical = shared_schema.regimens.cannonical
+        count_qry = sa.select([sa.func.count()]).select_from(dao.regimen)
+        count = next(dao.query(count_qry))[0]
+
+        harvoni_id = cannonical.find_or_create_regimen(dao, "HARVONI")
+        self.assertEqual(dao.get_regimen(harvoni_id).name, "HARVONI")
+        self.assertEqual(
+            cannonical.find_or_create_regimen(
+                dao, "(90mg ldv + 400mg sof) qd 12 weeks"
+            ),
+            harvoni_id,
+        )
+        new_id = cannonical.find_or_create_regimen(
+            dao, "123mg sof qd 3 days", name="custom"
+        )
+        self.assertEqual(
+            cannonical.find_or_create_regimen(dao, "123mg sof qd 3 days"),
+            new_id,
+        )
+        self.assertEqual(next(dao.query(count_qry))[0], count + 1)
+        stored = dao.get_regimen(new_id)
+        self.assertEqual(stored.name, "custom")
+        self.assertEqual(
+            stored.canonical_key,
+            cannonical.regimen_key(cannonical.from_dao(dao, new_id)),
+        )
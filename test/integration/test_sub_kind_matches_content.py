@@ -109,3 +109,34 @@ class TestContraintRejection(BaseDaoTest):
             }
             with self.assertRaises(sa.exc.IntegrityError):
                 self.dao.insert("substitution", ent)
+
+
+class TestBulkLoadingMixedKinds(BaseDaoTest):
+    def test_rows_with_different_columns(self):
+        alignment_id = self.fixtures["alignment"]["id"]
+        contents = [
+            {"kind": "deletion", "deletion_length": 3},
+            {"kind": "simple", "sub_aa": "h"},
+            {"kind": "insertion", "insertion": "gattaca"},
+            {"kind": "simple", "sub_aa": "k"},
+        ]
+        rows = [
+            {"alignment_id": alignment_id, "position": position, **values}
+            for position, values in enumerate(contents)
+        ]
+        self.assertEqual(self.dao.bulk_load("substitution", rows), 4)
+        stored = self.dao.query(
+            self.dao.substitution.select().order_by("position")
+        )
+        self.assertEqual(
+            [
+                (sub.kind, sub.sub_aa, sub.insertion, sub.deletion_length)
+                for sub in stored
+            ],
+            [
+                ("deletion", None, None, 3),
+                ("simple", "h", None, None),
+                ("insertion", None, "gattaca", None),
+                ("simple", "k", None, None),
+            ],
+        )
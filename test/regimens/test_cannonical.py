@@ -1,7 +1,10 @@
 """Test the hashable, equable, canonical regimen data object"""
 
+import array
 import collections
 import decimal
+import math
+import random
 import unittest
 import unittest.mock as mock
 import uuid
@@ -10,6 +13,8 @@ import pypeg2 as pp
 
 import shared_schema.regimens.cannonical as cannonical
 import shared_schema.regimens.grammar as rg
+import shared_schema.regimens.standard as standard
+
 
 # ---------------------------------------------------------------------
 # Helpers
@@ -50,6 +55,7 @@ boc_dose = cannonical._dose(amount=decimal.Decimal(3), compound="boc")
 duration_12wks = decimal.Decimal(12 * 7)
 duration_24wks = decimal.Decimal(24 * 7)
 
+
 # ---------------------------------------------------------------------
 # Data Object Construction
 
@@ -233,6 +239,35 @@ class TestMonoidalOperations(unittest.TestCase):
             cannonical.consolidating_insert(self.druglist_ab, self.dose_a1),
             frozenset([self.dose_a2, self.dose_b1]),
         )
+        with self.assertRaises(ValueError):
+            cannonical.consolidating_insert(
+                self.druglist_a, self.indication_a
+            )
+
+    def test_consolidate(self):
+        rnd = random.Random(0)
+        compounds = ["a", "b", "c", "d"]
+        doses = [
+            cannonical._dose(amount=rnd.randint(1, 9), compound=compound)
+            for compound in rnd.choices(compounds, k=1000)
+        ]
+        totals = collections.Counter()
+        for dose in doses:
+            totals[dose.compound] += dose.amount
+        self.assertEqual(
+            cannonical.consolidate(doses),
+            frozenset(
+                cannonical._dose(amount=amount, compound=compound)
+                for compound, amount in totals.items()
+            ),
+        )
+        self.assertEqual(cannonical.consolidate([]), frozenset())
+        self.assertEqual(
+            cannonical.consolidating_merge(
+                [self.dose_a1, self.dose_b1], self.druglist_a
+            ),
+            frozenset([self.dose_a2, self.dose_b1]),
+        )
 
 
 # ---------------------------------------------------------------------
@@ -379,3 +414,393 @@ class TestInclusions(unittest.TestCase):
                 self.assertEqual(incl.frequency, "tid")
             else:
                 self.fail("unexpected inclusions: {}".format(incl))
+
+
+class TestInclusionColumns(unittest.TestCase):
+    def setUp(self):
+        self.regimens = [
+            cannonical.from_string(src) for src in standard.regimens.values()
+        ]
+        self.regimens.append(
+            frozenset([
+                cannonical._regimen_part(
+                    duration=None,
+                    drug_combination=frozenset([
+                        cannonical._indication(
+                            frequency="qd",
+                            doselist=frozenset([
+                                cannonical._dose(
+                                    amount=decimal.Decimal("2.5"),
+                                    compound="sof",
+                                )
+                            ]),
+                        )
+                    ]),
+                )
+            ])
+        )
+
+    def expected_rows(self):
+        return sorted(
+            (
+                idx,
+                incl.medication_id,
+                float(incl.dose),
+                incl.frequency,
+                incl.duration,
+            )
+            for idx, regimen in enumerate(self.regimens)
+            for incl in cannonical.drug_inclusions(regimen)
+        )
+
+    def check_columns(self, columns):
+        lengths = {len(column) for column in columns}
+        self.assertEqual(len(lengths), 1)
+        ids = [uuid.uuid4() for _ in self.regimens]
+        records = list(cannonical.inclusion_records(columns, ids))
+        rows = sorted(
+            (
+                ids.index(rec["regimen_id"]),
+                rec["medication_id"],
+                rec["dose"],
+                rec["frequency"],
+                rec["duration"],
+            )
+            for rec in records
+        )
+        self.assertEqual(rows, self.expected_rows())
+
+    def test_array_columns(self):
+        columns = cannonical.inclusion_columns(self.regimens, use_numpy=False)
+        self.assertEqual(columns.dose.typecode, "d")
+        self.assertTrue(math.isnan(columns.duration[-1]))
+        self.check_columns(columns)
+
+    @unittest.skipIf(cannonical.numpy is None, "numpy isn't installed")
+    def test_numpy_columns(self):
+        columns = cannonical.inclusion_columns(self.regimens)
+        self.assertEqual(columns.regimen.dtype, cannonical.numpy.int64)
+        self.assertEqual(columns.dose.dtype, cannonical.numpy.float64)
+        self.check_columns(columns)
+
+    def test_numpy_required(self):
+        with mock.patch.object(cannonical, "numpy", None):
+            with self.assertRaises(ImportError):
+                cannonical.inclusion_columns(self.regimens, use_numpy=True)
+            columns = cannonical.inclusion_columns(self.regimens)
+        self.assertIsInstance(columns.regimen, array.array)
+
+
+# ---------------------------------------------------------------------
+# Compiled Parser
+
+
+def random_regimen_source(rnd):
+    """Generate a regimen string, occasionally with deliberate mistakes"""
+
+    def sometimes(good, bad, p=0.01):
+        return rnd.choice(bad) if rnd.random() < p else good
+
+    def space():
+        return rnd.choice(["", " ", " ", "  ", "\t", "\n"])
+
+    def number():
+        return sometimes(rnd.choice(["1", "7", "14", "0.5", ".25"]), ["3."])
+
+    def dose():
+        return "{}{}{}{}".format(
+            number(),
+            sometimes("mg", [" mg", "m"]),
+            sometimes(" ", ["", "  "]),
+            sometimes(rnd.choice(rg._compounds), ["SOF", "sofa"]),
+        )
+
+    def indication():
+        doses = [dose() for _ in range(rnd.randint(1, 3))]
+        src = (space() + "+" + space()).join(doses)
+        if rnd.random() < 0.4:
+            src = "(" + space() + src
+        if rnd.random() < 0.4:
+            src = src + space() + ")"
+        freq = sometimes(rnd.choice(rg._freqs), ["QD", "qdx"])
+        return src + rnd.choice([" ", "\t"]) + freq
+
+    def regimen_part():
+        indications = [indication() for _ in range(rnd.randint(1, 3))]
+        return "{} {}{}{}".format(
+            (space() + "&" + space()).join(indications),
+            number(),
+            space(),
+            sometimes(rnd.choice(rg._time_units), ["wk"]),
+        )
+
+    parts = [regimen_part() for _ in range(rnd.randint(1, 3))]
+    src = space() + (space() + "," + space()).join(parts) + space()
+    if rnd.random() < 0.1:
+        idx = rnd.randrange(len(src))
+        src = src[:idx] + rnd.choice("()+&,m1. ") + src[idx + 1:]
+    return src
+
+
+class TestCompiledParser(unittest.TestCase):
+    def assert_same_as_grammar(self, src):
+        try:
+            expected = cannonical.grammar_parse(src)
+        except (SyntaxError, ValueError) as err:
+            with self.assertRaises(type(err), msg=src):
+                cannonical.compiled_parse(src)
+        else:
+            self.assertEqual(expected, cannonical.compiled_parse(src), src)
+
+    def test_standard_regimens(self):
+        for src in standard.regimens.values():
+            self.assert_same_as_grammar(src)
+
+    def test_examples(self):
+        cases = [
+            "400mg sof qd 12 weeks",
+            " 400mg sof qd 12 weeks ",
+            "(1mg sof qd & 2mg dcv + 3mg glp) tid 1 week",
+            "(400mg sof qd 1 week",
+            "400mg sof) qd 1 week",
+            "1mg sof+1mg sof qd 7 days, 1mg sof qd 1 week",
+            "1mg sof qd 1weeks,2mg dcv bid 1 day",
+            ".5mg sof qd 1 week",
+            "1mg sof qd 1.5 weeks",
+            "400mg SOF QD 12 weeks",
+            "400 mg sof qd 12 weeks",
+            "400mg  sof qd 1 week",
+            "1mg sof qd1 week",
+            "1mg sof qd 1 week,",
+            "1mg sof qd 1 week ;",
+            "",
+        ]
+        for src in cases:
+            self.assert_same_as_grammar(src)
+
+    def test_random_regimens(self):
+        rnd = random.Random(20181017)
+        for _ in range(500):
+            self.assert_same_as_grammar(random_regimen_source(rnd))
+
+    def test_syntax_error_position(self):
+        with self.assertRaises(SyntaxError) as ctx:
+            cannonical.compiled_parse("1mg sof qd 1 week, 2mg xyz qd 1 day")
+        self.assertEqual(ctx.exception.offset, 24)
+        self.assertIn("xyz", str(ctx.exception))
+
+    def test_backend_selection(self):
+        src = standard.regimens["VIEKIRA PAK"]
+        self.assertEqual(
+            cannonical.from_string(src, backend="pypeg2"),
+            cannonical.from_string(src, backend="compiled"),
+        )
+        with self.assertRaises(ValueError):
+            cannonical.from_string(src, backend="no such backend")
+        with self.assertRaises(ValueError):
+            cannonical.set_default_backend("no such backend")
+        with mock.patch.object(cannonical, "_default_backend", "pypeg2"):
+            cannonical.set_default_backend("compiled")
+            self.assertEqual(cannonical._default_backend, "compiled")
+
+
+class TestFromStringCache(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(
+            cannonical, "_cache", cannonical.RegimenCache(maxsize=2)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_normalization_preserves_meaning(self):
+        rnd = random.Random(20181018)
+        sources = [random_regimen_source(rnd) for _ in range(300)]
+        sources.extend(["400mg  sof qd 1 week", "400mg\tsof qd 1 week"])
+        for src in sources:
+            normed = cannonical.normalize_source(src)
+            try:
+                expected = cannonical.compiled_parse(src)
+            except (SyntaxError, ValueError) as err:
+                with self.assertRaises(type(err), msg=src):
+                    cannonical.compiled_parse(normed)
+            else:
+                self.assertEqual(expected, cannonical.compiled_parse(normed))
+
+    def test_equivalent_sources_share_an_entry(self):
+        first = cannonical.from_string("(90mg ldv + 400mg sof) qd 12 weeks")
+        second = cannonical.from_string(
+            "  (90mg ldv +\n400mg sof)   qd 12   weeks "
+        )
+        self.assertIs(first, second)
+        info = cannonical.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+
+    def test_case_is_significant_outside_standard_names(self):
+        cannonical.from_string("400mg sof qd 12 weeks")
+        with self.assertRaises(SyntaxError):
+            cannonical.from_string("400mg SOF QD 12 weeks")
+
+    def test_errors_are_not_cached(self):
+        for _ in range(2):
+            with self.assertRaises(SyntaxError):
+                cannonical.from_string("ill-formed regimen")
+        self.assertEqual(cannonical.cache_info().currsize, 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        names = ("SOVALDI", "DAKLINZA", "OLYSIO")
+        sovaldi, daklinza, olysio = (standard.regimens[n] for n in names)
+        cannonical.from_string(sovaldi)
+        cannonical.from_string(daklinza)
+        cannonical.from_string(sovaldi)
+        cannonical.from_string(olysio)
+        self.assertEqual(cannonical.cache_info().currsize, 2)
+        cannonical.from_string(sovaldi)
+        cannonical.from_string(daklinza)
+        info = cannonical.cache_info()
+        self.assertEqual((info.hits, info.misses), (2, 4))
+
+    def test_resizing(self):
+        cannonical.set_cache_size(0)
+        cannonical.from_string(standard.regimens["SOVALDI"])
+        cannonical.from_string(standard.regimens["SOVALDI"])
+        info = cannonical.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (0, 2, 0))
+        cannonical.cache_clear()
+        self.assertEqual(cannonical.cache_info().misses, 0)
+        with self.assertRaises(ValueError):
+            cannonical.set_cache_size(-1)
+
+
+class TestStandardIndex(unittest.TestCase):
+    def test_every_standard_regimen_is_indexed(self):
+        index = cannonical.standard_index()
+        self.assertEqual(set(index.by_name), set(standard.regimens))
+        for name, src in standard.regimens.items():
+            regimen = index.by_name[name]
+            self.assertEqual(regimen, cannonical.grammar_parse(src))
+            self.assertIn(name, index.by_regimen[regimen])
+
+    def test_index_is_built_once(self):
+        self.assertIs(cannonical.standard_index(), cannonical.standard_index())
+        self.assertIs(
+            cannonical.from_string("harvoni"),
+            cannonical.standard_index().by_name["HARVONI"],
+        )
+
+    def test_reverse_lookup(self):
+        regimen = cannonical.from_string("(400mg sof + 90mg ldv) qd 84 days")
+        self.assertEqual(cannonical.standard_names(regimen), ("HARVONI",))
+        regimen = cannonical.from_string("1mg sof qd 1 day")
+        self.assertEqual(cannonical.standard_names(regimen), ())
+
+    def test_index_is_read_only(self):
+        index = cannonical.standard_index()
+        with self.assertRaises(TypeError):
+            index.by_name["NEW"] = frozenset()
+
+
+class TestCanonicalizeMany(unittest.TestCase):
+    sources = [
+        "HARVONI",
+        "ill-formed regimen",
+        "100mg sof bid 2 weeks",
+        "harvoni",
+        "HARVONI",
+        "1mg sof qd 1.5 days",
+        "100mg sof bid 2 weeks",
+    ]
+
+    def verify(self, results):
+        self.assertEqual([r.source for r in results], self.sources)
+        for result in results:
+            if result.error is None:
+                expected = cannonical.from_string(result.source)
+                self.assertEqual(result.regimen, expected)
+            else:
+                self.assertIsNone(result.regimen)
+        self.assertIs(results[1].error.type, SyntaxError)
+        self.assertEqual(
+            (results[1].error.lineno, results[1].error.offset), (1, 1)
+        )
+        self.assertEqual(results[1].error.text, "ill-formed regimen")
+        self.assertIs(results[5].error.type, ValueError)
+        self.assertIsNone(results[0].error)
+        self.assertIs(results[0].regimen, results[4].regimen)
+        self.assertIs(results[2].regimen, results[6].regimen)
+
+    def test_in_process(self):
+        self.verify(cannonical.canonicalize_many(self.sources, workers=1))
+
+    def test_process_pool(self):
+        results = cannonical.canonicalize_many(
+            iter(self.sources), workers=2, chunksize=2, backend="pypeg2"
+        )
+        self.verify(results)
+
+    def test_errors_do_not_depend_on_workers(self):
+        in_process = cannonical.canonicalize_many(self.sources, workers=1)
+        pooled = cannonical.canonicalize_many(
+            self.sources, workers=2, chunksize=1
+        )
+        self.assertEqual(
+            [r.error for r in in_process], [r.error for r in pooled]
+        )
+
+    def test_empty(self):
+        self.assertEqual(cannonical.canonicalize_many([]), [])
+
+
+class TestRegimenKey(unittest.TestCase):
+    def test_equal_regimens_have_equal_keys(self):
+        equivalents = [
+            "HARVONI",
+            "(90mg ldv + 400mg sof) qd 12 weeks",
+            "400mg sof + 90mg ldv qd 84 days",
+            "(45mg ldv + 400mg sof) qd 12 weeks, 45mg ldv qd 12 weeks",
+        ]
+        keys = {cannonical.regimen_key(cannonical.from_string(src))
+                for src in equivalents}
+        self.assertEqual(len(keys), 1)
+        self.assertEqual(
+            cannonical.canonical_text(cannonical.from_string("HARVONI")),
+            "(400mg sof + 90mg ldv) qd 84 days",
+        )
+        for src in standard.regimens.values():
+            regimen = cannonical.from_string(src)
+            text = cannonical.canonical_text(regimen)
+            self.assertEqual(cannonical.from_string(text), regimen)
+
+    def test_amounts_are_normalized(self):
+        from_db = frozenset([
+            cannonical._regimen_part(
+                duration=84,
+                drug_combination=frozenset([
+                    cannonical._indication(
+                        frequency="qd",
+                        doselist=frozenset([
+                            cannonical._dose(
+                                amount=decimal.Decimal("400.0000000000"),
+                                compound="sof",
+                            ),
+                            cannonical._dose(amount=90.0, compound="ldv"),
+                        ]),
+                    )
+                ]),
+            )
+        ])
+        self.assertEqual(
+            cannonical.regimen_key(from_db),
+            cannonical.regimen_key(cannonical.from_string("HARVONI")),
+        )
+
+    def test_different_regimens_have_different_keys(self):
+        sources = [
+            "400mg sof qd 12 weeks",
+            "400mg sof qd 8 weeks",
+            "400mg sof bid 12 weeks",
+            "200mg sof qd 12 weeks",
+            "400mg sof qd 12 weeks, 1mg rbv qd 1 week",
+        ]
+        keys = {cannonical.regimen_key(cannonical.from_string(src))
+                for src in sources}
+        self.assertEqual(len(keys), len(sources))
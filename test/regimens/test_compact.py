@@ -0,0 +1,69 @@
+import decimal
+import pickle
+import random
+import unittest
+
+import shared_schema.regimens.cannonical as cannonical
+import shared_schema.regimens.compact as compact
+import shared_schema.regimens.standard as standard
+
+from .test_cannonical import random_regimen_source
+
+
+class TestCompactRegimens(unittest.TestCase):
+    def test_round_trip(self):
+        for src in standard.regimens.values():
+            regimen = cannonical.from_string(src)
+            compacted = compact.compact(regimen)
+            self.assertEqual(compact.expand(compacted), regimen)
+
+    def test_round_trip_random_regimens(self):
+        rnd = random.Random(0)
+        checked = 0
+        while checked < 500:
+            try:
+                regimen = cannonical.from_string(random_regimen_source(rnd))
+            except (SyntaxError, ValueError):
+                continue
+            compacted = compact.compact(regimen)
+            self.assertEqual(compact.expand(compacted), regimen)
+            checked += 1
+
+    def test_equal_regimens_are_interned(self):
+        first = compact.compact(cannonical.from_string("HARVONI"))
+        second = compact.compact(
+            cannonical.from_string("(400mg sof + 90mg ldv) qd 84 days")
+        )
+        other = compact.compact(cannonical.from_string("1mg sof qd 1 day"))
+        self.assertIs(first, second)
+        self.assertEqual(hash(first), hash(second))
+        self.assertNotEqual(first, other)
+        self.assertIs(pickle.loads(pickle.dumps(first)), first)
+        self.assertEqual(len({first, second, other}), 2)
+
+    def test_amounts(self):
+        src = "1.25mg sof + 0.000001mg rbv qd 1 day"
+        regimen = cannonical.from_string(src)
+        compacted = compact.compact(regimen)
+        self.assertEqual(compact.expand(compacted), regimen)
+        (_, ((_, doses),)), = compacted.parts
+        self.assertEqual(sorted(amount for _, amount in doses), [1, 1250000])
+
+    def test_values_that_cant_be_compacted(self):
+        dose = cannonical._dose(
+            amount=decimal.Decimal("0.0000001"), compound="sof"
+        )
+        unknown = cannonical._dose(amount=1, compound="xyz")
+        for doses in ([dose], [unknown]):
+            regimen = frozenset([
+                cannonical._regimen_part(
+                    duration=None,
+                    drug_combination=frozenset([
+                        cannonical._indication(
+                            frequency="qd", doselist=frozenset(doses)
+                        )
+                    ]),
+                )
+            ])
+            with self.assertRaises(ValueError):
+                compact.compact(regimen)
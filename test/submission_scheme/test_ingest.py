@@ -0,0 +1,131 @@
+import csv
+import io
+import tempfile
+import unittest
+
+import shared_schema.dao
+from shared_schema.submission_scheme import ingest, simple
+
+NAMES = [fld.name for fld in simple.fields]
+
+
+def submission(*rows):
+    "A simple-scheme CSV file with the given (partial) rows"
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(NAMES)
+    for row in rows:
+        values = dict(regimen="HARVONI", seq_method="sanger", kind="bl")
+        values.update(row)
+        writer.writerow([values.get(name, "") for name in NAMES])
+    buffer.seek(0)
+    return buffer
+
+
+class TestIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dbfile = tempfile.NamedTemporaryFile()
+        db_url = "sqlite:///{}".format(self.tmp_dbfile.name)
+        self.dao = shared_schema.dao.DAO(db_url)
+        self.dao.init_db()
+
+    def tearDown(self):
+        self.tmp_dbfile.close()
+
+    def count(self, table):
+        return len(list(self.dao.query(table.select())))
+
+    def test_rows_are_mapped_to_entities(self):
+        csvfile = submission(
+            {"id": "p1", "sex": "Female", "year_of_birth": "1970"},
+            {"id": "p1", "kind": "eot", "alt": "12.5"},
+            {"id": "p2", "ltfu": "true", "died": "no", "seq_id": "s1"},
+        )
+        report = ingest.ingest(
+            self.dao,
+            csvfile,
+            study_name="demo",
+            sequences={"s1": "ACGT"},
+            chunk_size=1,
+            workers=1,
+        )
+        self.assertEqual(report.rows, 3)
+        self.assertEqual(report.invalid, 0)
+        self.assertEqual(
+            report.loaded,
+            {
+                "Person": 2,
+                "Case": 2,
+                "BehaviorData": 2,
+                "LossToFollowUp": 1,
+                "TreatmentData": 2,
+                "ClinicalData": 3,
+                "Isolate": 1,
+                "ClinicalIsolate": 1,
+                "Sequence": 1,
+            },
+        )
+        person = next(self.dao.query(self.dao.person.select()))
+        self.assertEqual((person.sex, person.year_of_birth), ("female", 1970))
+        cases = list(self.dao.query(self.dao.case.select()))
+        self.assertEqual({case.study_name for case in cases}, {"demo"})
+        regimen_ids = {
+            treatment.regimen_id
+            for treatment in self.dao.query(self.dao.treatmentdata.select())
+        }
+        self.assertEqual(len(regimen_ids), 1)
+        self.assertEqual(self.count(self.dao.regimen), 1)
+        sequence = next(self.dao.query(self.dao.sequence.select()))
+        self.assertEqual(sequence.raw_nt_seq, "ACGT")
+
+    def test_existing_participants_are_reused(self):
+        ingest.ingest(self.dao, submission({"id": "p1"}), workers=1)
+        report = ingest.ingest(
+            self.dao, submission({"id": "p1", "kind": "eot"}), workers=1
+        )
+        self.assertEqual(report.loaded, {"ClinicalData": 1})
+        self.assertEqual(self.count(self.dao.case), 1)
+
+    def test_invalid_rows_are_skipped(self):
+        csvfile = submission(
+            {"id": "p1", "year_of_birth": "soon"},
+            {"id": "p2", "regimen": "not a regimen"},
+            {"id": "p3", "seq_id": "missing"},
+            {"kind": ""},
+            {"id": "p5"},
+        )
+        report = ingest.ingest(self.dao, csvfile, workers=1)
+        self.assertEqual((report.rows, report.invalid), (5, 4))
+        found = {(err.row, err.field) for err in report.errors}
+        self.assertEqual(
+            found,
+            {
+                (0, "year_of_birth"),
+                (1, "regimen"),
+                (2, "seq_id"),
+                (3, "id"),
+                (3, "kind"),
+            },
+        )
+        self.assertEqual(report.loaded["Case"], 1)
+
+    def test_parallel_parsing(self):
+        rows = [{"id": "p{}".format(idx // 2)} for idx in range(20)]
+        report = ingest.ingest(
+            self.dao, submission(*rows), chunk_size=3, workers=2
+        )
+        self.assertEqual(report.rows, 20)
+        self.assertEqual(report.loaded["Case"], 10)
+        self.assertEqual(report.loaded["ClinicalData"], 20)
+
+    def test_few_columns_and_rows(self):
+        csvfile = io.StringIO(
+            "id,kind,regimen,seq_method\n"
+            "p1,bl,HARVONI,sanger\n"
+            "p1,eot,HARVONI,sanger\n"
+            "p2,bl,HARVONI,sanger\n"
+        )
+        report = ingest.ingest(self.dao, csvfile, workers=1)
+        self.assertEqual((report.rows, report.invalid), (3, 0))
+        self.assertEqual(report.loaded["ClinicalData"], 3)
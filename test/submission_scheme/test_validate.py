@@ -0,0 +1,98 @@
+import unittest
+
+from shared_schema.submission_scheme import field, validate
+
+
+def scheme_field(name, schema_type, **kwargs):
+    return field.Field(name, schema_type, schema_path="test", **kwargs)
+
+
+FIELDS = [
+    scheme_field("id", "string", req=True),
+    scheme_field("kind", "enum(bl, eot)", req=True),
+    scheme_field("year", "integer", value_range=(1900, 2100)),
+    scheme_field("cutoff", "float"),
+    scheme_field("date", "date"),
+    scheme_field("ltfu", "bool"),
+]
+
+COLUMNS = {
+    "id": ["a", "b", "", "d", "e"],
+    "kind": ["bl", "EOT ", "fw4", "", "bl"],
+    "year": ["1970", "", "3000", "19.5", "2001"],
+    "cutoff": ["5", "5.5", "nan", "", "x"],
+    "date": ["2019-01-02", "", "2019-02-30", "2019", "2019-12-31"],
+    "ltfu": ["true", "F", "", "maybe", "yes"],
+    "ignored": ["?"] * 5,
+}
+
+EXPECTED = {
+    "id": [0, 0, 1, 0, 0],
+    "kind": [0, 0, 1, 1, 0],
+    "year": [0, 0, 1, 1, 0],
+    "cutoff": [0, 0, 1, 0, 1],
+    "date": [0, 0, 1, 1, 0],
+    "ltfu": [0, 0, 0, 1, 0],
+}
+
+
+class TestValidateColumns(unittest.TestCase):
+
+    def check(self, use_numpy):
+        masks = validate.validate_columns(FIELDS, COLUMNS, use_numpy)
+        found = {
+            name: [int(bad) for bad in mask] for name, mask in masks.items()
+        }
+        self.assertEqual(found, EXPECTED)
+        self.assertEqual(validate.invalid_rows(masks), [2, 3, 4])
+
+    def test_python(self):
+        self.check(use_numpy=False)
+
+    @unittest.skipIf(validate.numpy is None, "needs numpy")
+    def test_numpy(self):
+        self.check(use_numpy=True)
+
+    @unittest.skipIf(validate.numpy is None, "needs numpy")
+    def test_numpy_numbers(self):
+        fld = scheme_field("year", "integer", value_range=(0, 100))
+        values = [str(n) for n in range(200)]
+        mask = validate.column_mask(fld, values, use_numpy=True)
+        self.assertEqual(list(mask), [n > 100 for n in range(200)])
+
+    @unittest.skipIf(validate.numpy is None, "needs numpy")
+    def test_numpy_blank_numbers(self):
+        fields = [
+            scheme_field("stiff", "float"),
+            scheme_field("year", "integer"),
+            scheme_field("alt", "float", req=True),
+        ]
+        cases = [
+            {},
+            {"stiff": [None, "1.0", "2.0"], "year": ["", " ", "1970"]},
+            {"stiff": [str(n) for n in range(99)] + [""]},
+            {"alt": [str(n) for n in range(99)] + [None]},
+        ]
+        for columns in cases:
+            if not columns:
+                columns = {"other": ["x"] * 3}
+            with_numpy = validate.validate_columns(fields, columns, True)
+            without = validate.validate_columns(fields, columns, False)
+            for name, mask in with_numpy.items():
+                self.assertEqual(
+                    list(mask), [bool(bad) for bad in without[name]]
+                )
+        masks = validate.validate_columns(fields, cases[1], True)
+        self.assertEqual(validate.invalid_rows(masks), [0, 1, 2])
+        self.assertFalse(any(masks["stiff"]) or any(masks["year"]))
+
+    def test_missing_columns(self):
+        masks = validate.validate_columns(
+            FIELDS, {"year": ["1970", "1980"]}, use_numpy=False
+        )
+        self.assertEqual(list(masks["kind"]), [1, 1])
+        self.assertEqual(list(masks["date"]), [0, 0])
+
+    def test_uneven_columns(self):
+        with self.assertRaises(ValueError):
+            validate.validate_columns(FIELDS, {"id": ["a"], "kind": []})
@@ -0,0 +1,98 @@
+import importlib.util
+import sys
+import tempfile
+import unittest
+import uuid
+
+import sqlalchemy as sa
+
+from shared_schema import dao
+from shared_schema.regimens import cannonical
+from test.test_dao import insert_legacy_regimen, legacy_dao
+
+# NOTE: IsolatedAsyncioTestCase is new in Python 3.8; on older versions
+# the tests are defined on a plain TestCase, and skipped.
+if (
+    sys.version_info >= (3, 8)
+    and importlib.util.find_spec("aiosqlite") is not None
+):
+    from shared_schema import asyncdao
+else:
+    asyncdao = None
+
+AsyncTestCase = getattr(
+    unittest, "IsolatedAsyncioTestCase", unittest.TestCase
+)
+
+
+@unittest.skipIf(asyncdao is None, "needs Python 3.8+ and aiosqlite")
+class TestAsyncDao(AsyncTestCase):
+    async def asyncSetUp(self):
+        self.db_file = tempfile.NamedTemporaryFile()
+        db_url = "sqlite+aiosqlite:///{}".format(self.db_file.name)
+        self.dao = asyncdao.AsyncDAO(db_url)
+        await self.dao.init_db()
+
+    async def asyncTearDown(self):
+        await self.dao.dispose()
+        self.db_file.close()
+
+    async def rows(self, expr):
+        return [row async for row in self.dao.query(expr)]
+
+    async def test_insert_and_query(self):
+        people = [
+            {"id": uuid.uuid4(), "sex": "other", "year_of_birth": 1970 + i}
+            for i in range(3)
+        ]
+        await self.dao.insert_many("person", people[:2])
+        await self.dao.insert("person", people[2])
+        rows = await self.rows(
+            self.dao.person.select().order_by(self.dao.person.c.year_of_birth)
+        )
+        self.assertEqual([row.id for row in rows], [p["id"] for p in people])
+
+    async def test_insert_or_check_identical(self):
+        person = {"id": uuid.uuid4(), "sex": "other", "year_of_birth": 1970}
+        for _ in range(2):
+            await self.dao.insert_or_check_identical("person", person)
+        self.assertEqual(len(await self.rows(self.dao.person.select())), 1)
+        with self.assertRaises(ValueError):
+            await self.dao.insert_or_check_identical(
+                "person", dict(person, year_of_birth=1971)
+            )
+
+    async def test_transactions_roll_back(self):
+        person = {"id": uuid.uuid4(), "sex": "other"}
+        with self.assertRaises(sa.exc.IntegrityError):
+            async with self.dao.transaction():
+                await self.dao.insert("person", person)
+                await self.dao.insert("person", person)
+        self.assertEqual(await self.rows(self.dao.person.select()), [])
+
+    async def test_load_standard_regimens(self):
+        reg_ids = await self.dao.load_standard_regimens()
+        names = cannonical.standard_index().by_name
+        self.assertEqual(len(reg_ids), len(names))
+        regimen = await self.dao.get_regimen(reg_ids[0])
+        self.assertIn(regimen.name, names)
+        inclusions = await self.rows(self.dao.regimendruginclusion.select())
+        self.assertGreater(len(inclusions), len(reg_ids))
+
+    async def test_init_db_upgrades_old_databases(self):
+        legacy = legacy_dao()
+        reg_id = insert_legacy_regimen(legacy, "HARVONI")
+        db_url = str(legacy.engine.url).replace("sqlite:", "sqlite+aiosqlite:")
+        old = asyncdao.AsyncDAO(db_url, uuid_type=dao.CharUUID)
+        try:
+            await old.init_db()
+            await old.load_regimens([("test", "400mg sof qd 12 weeks")])
+            regimens = {
+                row.id: row.canonical_key
+                async for row in old.query(old.regimen.select())
+            }
+        finally:
+            await old.dispose()
+        harvoni = cannonical.regimen_key(cannonical.from_string("HARVONI"))
+        self.assertEqual(len(regimens), 2)
+        self.assertEqual(regimens[reg_id], harvoni)
@@ -1,11 +1,16 @@
+import gc
 import tempfile
 import unittest
+import unittest.mock as mock
 import uuid
+import weakref
 
 import sqlalchemy as sa
 from sqlalchemy import sql
+from sqlalchemy.dialects import postgresql
 
-from shared_schema import dao, tables
+from shared_schema import dao, data, tables
+from shared_schema.regimens import cannonical
 
 
 def tmp_dao(**kwargs):
@@ -14,6 +19,63 @@ def tmp_dao(**kwargs):
     return dao.DAO(db_url, **kwargs)
 
 
+# Tables as created before UUIDs were compacted and regimens got a
+# canonical key.
+LEGACY_DDL = [
+    """CREATE TABLE "Person" (
+        id CHAR NOT NULL,
+        sex VARCHAR(6),
+        ethnicity VARCHAR(6),
+        year_of_birth INTEGER,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE "Case" (
+        id CHAR NOT NULL,
+        person_id CHAR NOT NULL,
+        study_name VARCHAR,
+        country VARCHAR,
+        study_participant_id VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY(person_id) REFERENCES "Person" (id)
+    )""",
+    """CREATE TABLE "Regimen" (
+        id CHAR NOT NULL,
+        name VARCHAR,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE "RegimenDrugInclusion" (
+        medication_id VARCHAR(3),
+        regimen_id CHAR,
+        dose FLOAT,
+        frequency VARCHAR(3),
+        duration INTEGER,
+        PRIMARY KEY (medication_id, regimen_id),
+        FOREIGN KEY(regimen_id) REFERENCES "Regimen" (id)
+    )""",
+]
+
+
+def legacy_dao():
+    "A CharUUID DAO for a database with the LEGACY_DDL tables"
+    legacy = tmp_dao(uuid_type=dao.CharUUID)
+    with legacy.transaction() as conn:
+        for ddl in LEGACY_DDL:
+            conn.execute(sa.text(ddl))
+    return legacy
+
+
+def insert_legacy_regimen(legacy, src):
+    "Store a regimen the way it was stored before it had a canonical key"
+    reg_id = uuid.uuid4()
+    regimen = cannonical.from_string(src)
+    with legacy.transaction():
+        legacy.insert("regimen", {"id": reg_id, "name": src})
+        legacy.insert_many(
+            "regimendruginclusion", legacy._inclusion_rows(reg_id, regimen)
+        )
+    return reg_id
+
+
 class TestUuidType(unittest.TestCase):
     def test_serialization_and_deserialization(self):
         for i in range(10000):
@@ -21,6 +83,54 @@ class TestUuidType(unittest.TestCase):
             s = dao.UUID.as_str(u)
             assert uuid.UUID(s) == u
 
+    def test_compact_storage(self):
+        d = tmp_dao()
+        d.init_db()
+        person = {"id": uuid.uuid4(), "sex": "other"}
+        d.insert("person", person)
+        raw = next(d.query("SELECT typeof(id), length(id) FROM person"))
+        self.assertEqual(tuple(raw), ("blob", 16))
+        self.assertEqual(next(d.query(d.person.select())).id, person["id"])
+
+    def test_native_postgres_type(self):
+        id_type = dao.DAO("sqlite://").person.c.id.type
+        pg_dialect = postgresql.psycopg2.dialect()
+        self.assertEqual(id_type.compile(dialect=pg_dialect), "UUID")
+
+    def test_migrating_char_uuids(self):
+        legacy = legacy_dao()
+        person = {"id": uuid.uuid4(), "sex": "other", "year_of_birth": 1970}
+        legacy.insert("person", person)
+        legacy.insert("case", {"id": uuid.uuid4(), "person_id": person["id"]})
+        raw = next(legacy.query("SELECT id FROM person"))
+        self.assertEqual(raw.id, person["id"].hex)
+
+        migrated = tmp_dao()
+        copied = dao.migrate_char_uuids(str(legacy.engine.url), migrated)
+        self.assertEqual(copied["Person"], 1)
+        self.assertEqual(copied["Case"], 1)
+        self.assertEqual(
+            list(migrated.query(migrated.case.select())),
+            list(legacy.query(legacy.case.select())),
+        )
+        raw = next(migrated.query("SELECT typeof(person_id) FROM \"case\""))
+        self.assertEqual(raw[0], "blob")
+
+    def test_migrating_regimens_without_keys(self):
+        legacy = legacy_dao()
+        reg_id = insert_legacy_regimen(legacy, "HARVONI")
+
+        migrated = tmp_dao()
+        copied = dao.migrate_char_uuids(str(legacy.engine.url), migrated)
+        self.assertEqual(copied["Regimen"], 1)
+        self.assertEqual(copied["Isolate"], 0)
+        found = cannonical.find_or_create_regimen(
+            migrated, "(90mg ldv + 400mg sof) qd 12 weeks"
+        )
+        self.assertEqual(found, reg_id)
+        regimens = list(migrated.query(migrated.regimen.select()))
+        self.assertEqual(len(regimens), 1)
+
 
 class TestTableConversion(unittest.TestCase):
     def test_compound_primary_keys(self):
@@ -42,6 +152,183 @@ class TestTableConversion(unittest.TestCase):
         self.assertIn("b", keys)
 
 
+class TestIndexes(unittest.TestCase):
+    def indexed_columns(self, d, table_name):
+        inspector = sa.inspect(d.engine)
+        return {
+            index["name"]: tuple(index["column_names"])
+            for index in inspector.get_indexes(table_name)
+        }
+
+    def test_foreign_key_indexes(self):
+        d = tmp_dao()
+        d.init_db()
+        self.assertEqual(
+            self.indexed_columns(d, "Alignment"),
+            {
+                "ix_alignment_sequence_id": ("sequence_id",),
+                "ix_alignment_reference_id": ("reference_id",),
+            },
+        )
+        # Substitution.alignment_id leads the primary key's index
+        self.assertEqual(self.indexed_columns(d, "Substitution"), {})
+        self.assertEqual(
+            self.indexed_columns(d, "ClinicalIsolate"),
+            {"ix_clinicalisolate_case_id": ("case_id",)},
+        )
+
+    def test_declared_indexes(self):
+        entity = tables.Entity.make(
+            "TestEntity",
+            "The test entity",
+            [
+                tables.Field.make("a", "integer", "Test field 'a'"),
+                tables.Field.make("b", "integer", "Test field 'b'"),
+                tables.Field.make("c", "string", "Test field 'c'"),
+            ],
+            meta={
+                "primary key": "a",
+                "indexes": {"ix_test_b_c": ("b", "c"), "ix_test_c": "c"},
+            },
+        )
+        d = tmp_dao(schema_data=tables.Schema([entity]))
+        d.init_db()
+        self.assertEqual(
+            self.indexed_columns(d, "TestEntity"),
+            {"ix_test_b_c": ("b", "c"), "ix_test_c": ("c",)},
+        )
+
+    def test_indexes_must_name_fields(self):
+        with self.assertRaises(UserWarning):
+            tables.Entity.make(
+                "TestEntity",
+                "The test entity",
+                [tables.Field.make("a", "integer", "Test field 'a'")],
+                meta={"primary key": "a", "indexes": {"ix_test": ("b",)}},
+            )
+
+    def test_init_db_adds_missing_indexes(self):
+        old = tmp_dao(fk_indexes=False)
+        old.init_db()
+        self.assertEqual(self.indexed_columns(old, "Alignment"), {})
+        new = dao.DAO(str(old.engine.url))
+        new.init_db()
+        self.assertEqual(len(self.indexed_columns(new, "Alignment")), 2)
+
+    def test_init_db_adds_regimen_keys(self):
+        legacy = legacy_dao()
+        reg_id = insert_legacy_regimen(legacy, "HARVONI")
+        legacy.init_db()
+        self.assertEqual(
+            self.indexed_columns(legacy, "Regimen"),
+            {"ix_regimen_canonical_key": ("canonical_key",)},
+        )
+        stored = next(legacy.query(legacy.regimen.select()))
+        harvoni = cannonical.from_string("HARVONI")
+        self.assertEqual(stored.canonical_key, cannonical.regimen_key(harvoni))
+        found = cannonical.find_or_create_regimen(legacy, harvoni)
+        self.assertEqual(found, reg_id)
+        self.assertEqual(len(list(legacy.query(legacy.regimen.select()))), 1)
+
+    def test_init_db_checks_uuid_storage_first(self):
+        legacy = legacy_dao()
+        insert_legacy_regimen(legacy, "HARVONI")
+        with self.assertRaisesRegex(ValueError, "CharUUID"):
+            dao.DAO(str(legacy.engine.url)).init_db()
+        columns = sa.inspect(legacy.engine).get_columns("Regimen")
+        self.assertEqual([col["name"] for col in columns], ["id", "name"])
+        self.assertEqual(self.indexed_columns(legacy, "Case"), {})
+
+        compact = tmp_dao()
+        compact.init_db()
+        compact.load_regimens([("test", "400mg sof qd 12 weeks")])
+        with self.assertRaisesRegex(ValueError, "Regimen.id"):
+            dao.DAO(str(compact.engine.url), uuid_type=dao.CharUUID).init_db()
+        dao.DAO(str(compact.engine.url)).init_db()
+
+    def test_missing_required_columns_are_not_added(self):
+        legacy = legacy_dao()
+        with legacy.transaction() as conn:
+            conn.execute(sa.text('CREATE TABLE "Isolate" (id CHAR)'))
+        with self.assertRaises(ValueError):
+            legacy.init_db()
+
+
+class TestLazyTables(unittest.TestCase):
+    def setUp(self):
+        self.schema = tables.Schema(data.schema_data.raw_entities)
+
+    def test_tables_are_built_on_first_use(self):
+        d = tmp_dao(schema_data=self.schema)
+        self.assertEqual(d._meta.tables, {})
+        sequence = d.sequence
+        self.assertIs(d.sequence, sequence)
+        self.assertEqual(set(d._meta.tables), {"Sequence", "Isolate"})
+        self.assertIs(d._table("Isolate"), d.isolate)
+        with self.assertRaises(AttributeError):
+            d.nonexistent
+        with self.assertRaises(ValueError):
+            d._table("nonexistent")
+        self.assertEqual(len(d.tables), len(self.schema.entities))
+
+    def test_metadata_is_shared_per_schema(self):
+        first = tmp_dao(schema_data=self.schema)
+        second = tmp_dao(schema_data=self.schema)
+        self.assertIs(first._meta, second._meta)
+        self.assertIs(first.person, second.person)
+        legacy = tmp_dao(schema_data=self.schema, uuid_type=dao.CharUUID)
+        self.assertIsNot(legacy._meta, first._meta)
+        other = tmp_dao(schema_data=tables.Schema(self.schema.raw_entities))
+        self.assertIsNot(other._meta, first._meta)
+
+    def test_released_schemas_are_forgotten(self):
+        schema = tables.Schema(self.schema.raw_entities)
+        d = tmp_dao(schema_data=schema)
+        d.person
+        schema_ref = weakref.ref(schema)
+        self.assertIn(schema, dao._schema_tables)
+        del schema
+        gc.collect()
+        self.assertIsNotNone(schema_ref())
+        del d
+        gc.collect()
+        self.assertIsNone(schema_ref())
+
+    def test_foreign_keys_are_enforced_on_every_connection(self):
+        d = tmp_dao()
+        d.init_db()
+        orphan = {"id": uuid.uuid4(), "person_id": uuid.uuid4()}
+        for _ in range(2):
+            with self.assertRaises(sa.exc.IntegrityError):
+                d.insert("case", orphan)
+
+
+class TestSqliteProfiles(unittest.TestCase):
+    def pragma(self, d, name):
+        return next(d.query("PRAGMA {}".format(name)))[0]
+
+    def test_profiles_apply_to_every_connection(self):
+        d = tmp_dao(sqlite_profile="bulk-load")
+        for _ in range(2):
+            self.assertEqual(self.pragma(d, "journal_mode"), "wal")
+            self.assertEqual(self.pragma(d, "synchronous"), 0)
+            self.assertEqual(self.pragma(d, "cache_size"), -262144)
+            self.assertEqual(self.pragma(d, "temp_store"), 2)
+            self.assertEqual(self.pragma(d, "foreign_keys"), 1)
+        d = tmp_dao(sqlite_profile="read-mostly")
+        self.assertEqual(self.pragma(d, "synchronous"), 1)
+        self.assertEqual(self.pragma(d, "mmap_size"), 1073741824)
+
+    def test_default_settings(self):
+        d = tmp_dao()
+        self.assertEqual(self.pragma(d, "journal_mode"), "delete")
+        self.assertEqual(self.pragma(d, "foreign_keys"), 1)
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            tmp_dao(sqlite_profile="fastest")
+
+
 class TestLoadStandardRegimens(unittest.TestCase):
     """Verify that standard regimens can be loaded"""
 
@@ -59,6 +346,321 @@ class TestLoadStandardRegimens(unittest.TestCase):
         )
 
 
+class TestLoadRegimens(unittest.TestCase):
+    def setUp(self):
+        self.dao = tmp_dao()
+        self.dao.init_db()
+
+    def count(self, table):
+        qry = sa.select([sa.func.count()]).select_from(table)
+        return next(self.dao.query(qry))[0]
+
+    def test_arbitrary_regimens_are_loaded(self):
+        named_regimens = [
+            ("custom", "100mg sof qd & (1mg dcv + 2mg rbv) bid 2 weeks"),
+            (None, "1mg sof qd 1 day"),
+            ("HARVONI", cannonical.from_string("HARVONI")),
+        ]
+        ids = self.dao.load_regimens(iter(named_regimens))
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(self.count(self.dao.regimen), 3)
+        self.assertEqual(self.count(self.dao.regimendruginclusion), 6)
+        for reg_id, (_, src) in zip(ids, named_regimens):
+            if isinstance(src, str):
+                src = cannonical.from_string(src)
+            self.assertEqual(cannonical.from_dao(self.dao, reg_id), src)
+
+    def test_single_transaction(self):
+        with mock.patch.object(
+            self.dao.engine, "begin", wraps=self.dao.engine.begin
+        ) as begin:
+            self.dao.load_standard_regimens()
+        begin.assert_called_once_with()
+
+    def test_nothing_to_load(self):
+        self.assertEqual(self.dao.load_regimens([]), [])
+        self.assertEqual(self.count(self.dao.regimen), 0)
+
+
+class TestTransactions(unittest.TestCase):
+    def setUp(self):
+        self.dao = tmp_dao()
+        self.dao.init_db()
+
+    def people(self, number):
+        return [
+            {"id": uuid.uuid4(), "sex": "other", "year_of_birth": 1980 + i}
+            for i in range(number)
+        ]
+
+    def count_people(self):
+        qry = sa.select([sa.func.count()]).select_from(self.dao.person)
+        return next(self.dao.query(qry))[0]
+
+    def test_calls_share_one_connection(self):
+        with mock.patch.object(
+            self.dao.engine, "begin", wraps=self.dao.engine.begin
+        ) as begin:
+            with self.dao.transaction() as conn:
+                for person in self.people(10):
+                    self.dao.insert("person", person)
+                self.dao.insert_or_check_identical("person", person)
+                with self.dao.transaction() as inner:
+                    self.assertIs(conn, inner)
+                    self.assertEqual(self.count_people(), 10)
+        begin.assert_called_once_with()
+        self.assertEqual(self.count_people(), 10)
+
+    def test_rollback_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with self.dao.transaction():
+                self.dao.insert_many("person", self.people(3))
+                raise RuntimeError("abort")
+        self.assertEqual(self.count_people(), 0)
+        self.dao.insert_many("person", self.people(2))
+        self.assertEqual(self.count_people(), 2)
+
+
+class TestStreamingQueries(unittest.TestCase):
+    def setUp(self):
+        self.dao = tmp_dao(fetch_size=4)
+        self.dao.init_db()
+        self.people = [
+            {"id": uuid.uuid4(), "sex": "other", "year_of_birth": 1900 + i}
+            for i in range(10)
+        ]
+        self.dao.insert_many("person", self.people)
+        self.select = self.dao.person.select().order_by(
+            self.dao.person.c.year_of_birth
+        )
+
+    def test_streamed_rows_match_query(self):
+        expected = list(self.dao.query(self.select))
+        self.assertEqual(list(self.dao.stream(self.select)), expected)
+        self.assertEqual(
+            list(self.dao.stream(self.select, fetch_size=1)), expected
+        )
+
+    def test_rows_are_fetched_in_batches(self):
+        fetch_sizes = []
+        fetchmany = sa.engine.ResultProxy.fetchmany
+
+        def spy(result, size=None):
+            fetch_sizes.append(size)
+            return fetchmany(result, size)
+
+        with mock.patch.object(sa.engine.ResultProxy, "fetchmany", spy):
+            rows = list(self.dao.stream(self.select))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(fetch_sizes, [4, 4, 4, 4])
+
+    def test_early_close(self):
+        rows = self.dao.stream(self.select)
+        self.assertEqual(next(rows)["id"], self.people[0]["id"])
+        rows.close()
+        self.assertEqual(len(list(self.dao.query(self.select))), 10)
+
+    def test_stream_in_transaction(self):
+        with self.dao.transaction():
+            self.dao.insert(
+                "person", {"id": uuid.uuid4(), "year_of_birth": 2000}
+            )
+            self.assertEqual(len(list(self.dao.stream(self.select))), 11)
+
+
+class TestBulkLoad(unittest.TestCase):
+    def setUp(self):
+        self.dao = tmp_dao()
+        self.dao.init_db()
+
+    def people(self, number):
+        return (
+            {"id": uuid.uuid4(), "sex": "other", "year_of_birth": 1900 + i}
+            for i in range(number)
+        )
+
+    def count(self, table):
+        qry = sa.select([sa.func.count()]).select_from(table)
+        return next(self.dao.query(qry))[0]
+
+    def test_rows_are_loaded_in_batches(self):
+        with mock.patch.object(
+            self.dao.engine, "begin", wraps=self.dao.engine.begin
+        ) as begin:
+            loaded = self.dao.bulk_load("Person", self.people(25), 10)
+        begin.assert_called_once_with()
+        self.assertEqual(loaded, 25)
+        self.assertEqual(self.count(self.dao.person), 25)
+        row = next(self.dao.query(self.dao.person.select()))
+        self.assertIsInstance(row["id"], uuid.UUID)
+
+    def test_failed_batch_rolls_back_everything(self):
+        rows = list(self.people(15))
+        rows[12]["id"] = rows[3]["id"]
+        with self.assertRaises(sa.exc.IntegrityError):
+            self.dao.bulk_load("person", rows, batch_size=10)
+        self.assertEqual(self.count(self.dao.person), 0)
+
+    def test_unknown_columns_and_tables(self):
+        with self.assertRaises(ValueError):
+            self.dao.bulk_load("person", [{"id": uuid.uuid4(), "x": 1}])
+        with self.assertRaises(ValueError):
+            self.dao.bulk_load("not a table", [])
+        with self.assertRaises(ValueError):
+            self.dao.bulk_load("insert", [])
+
+    def test_copy_buffer_encoding(self):
+        pg_dialect = postgresql.psycopg2.dialect()
+        uid = uuid.uuid4()
+        rows = [
+            {"alignment_id": uid, "position": 1, "kind": "simple",
+             "sub_aa": 'a"b,c'},
+            {"alignment_id": uid, "position": 2, "kind": "insertion",
+             "insertion": ""},
+        ]
+        buffer = dao.copy_buffer(self.dao.substitution, rows, pg_dialect)
+        expected_id = str(uid)
+        self.assertEqual(
+            buffer.read().splitlines(),
+            [
+                '"{}","1","simple","a""b,c",,'.format(expected_id),
+                '"{}","2","insertion",,"",'.format(expected_id),
+            ],
+        )
+
+
+class TestStatementCache(unittest.TestCase):
+    def setUp(self):
+        self.dao = tmp_dao()
+        self.dao.init_db()
+
+    def test_statements_are_compiled_once(self):
+        first = self.dao.statement("person", "insert", ["id", "sex"])
+        second = self.dao.statement("Person", "insert", ["sex", "id"])
+        self.assertIs(first, second)
+        self.assertIsNot(first, self.dao.statement("person", "insert", ["id"]))
+        self.assertIs(
+            self.dao.statement("person", "get"),
+            self.dao.statement("person", "select", ["id"]),
+        )
+        with self.assertRaises(ValueError):
+            self.dao.statement("person", "delete")
+
+    def test_cached_statements(self):
+        person = {"id": uuid.uuid4(), "sex": "other", "year_of_birth": 1970}
+        self.dao.insert("person", person)
+        for _ in range(2):
+            self.dao.insert_or_check_identical("person", person)
+        with self.assertRaises(ValueError):
+            self.dao.insert_or_check_identical(
+                "person", dict(person, year_of_birth=1971)
+            )
+        select = self.dao.statement("person", "select", ["year_of_birth"])
+        rows = list(self.dao.query(select, {"year_of_birth": 1970}))
+        self.assertEqual([row.id for row in rows], [person["id"]])
+
+        reg_id = self.dao.load_regimens([("test", "400mg sof qd 12 weeks")])[0]
+        for _ in range(2):
+            self.assertEqual(self.dao.get_regimen(reg_id).id, reg_id)
+            self.assertEqual(
+                cannonical.from_dao(self.dao, reg_id),
+                cannonical.from_string("400mg sof qd 12 weeks"),
+            )
+        self.assertIsNone(self.dao.get_regimen(uuid.uuid4()))
+        self.assertEqual(
+            set(self.dao._statements),
+            {
+                ("Person", "insert", ("id", "sex", "year_of_birth")),
+                ("Person", "select", ("id",)),
+                ("Person", "select", ("year_of_birth",)),
+                ("Regimen", "select", ("id",)),
+                ("regimen", "from_dao"),
+            },
+        )
+
+
+class TestInsertOrCheckIdenticalMany(unittest.TestCase):
+    def setUp(self):
+        self.dao = tmp_dao()
+        self.dao.init_db()
+        self.statements = []
+        sa.event.listen(
+            self.dao.engine, "before_cursor_execute", self.record_statement
+        )
+
+    def record_statement(self, conn, cursor, statement, *args):
+        self.statements.append(statement.split()[0])
+
+    def test_reconciling_people(self):
+        people = [
+            {"id": uuid.uuid4(), "sex": "other", "year_of_birth": 1980 + i}
+            for i in range(6)
+        ]
+        self.dao.insert_many("person", people[:3])
+        changed = dict(people[1], year_of_birth=1900)
+        self.statements.clear()
+        mismatches = self.dao.insert_or_check_identical_many(
+            "person", people + [changed, people[4]], batch_size=5
+        )
+        self.assertEqual(self.statements, ["SELECT", "INSERT"] * 2)
+        self.assertEqual(
+            mismatches,
+            [
+                dao.Mismatch(
+                    table="person",
+                    key=(people[1]["id"],),
+                    field="year_of_birth",
+                    existing=1981,
+                    given=1900,
+                )
+            ],
+        )
+        count_qry = sa.select([sa.func.count()]).select_from(self.dao.person)
+        self.assertEqual(next(self.dao.query(count_qry))[0], 6)
+
+    def test_compound_primary_key(self):
+        collaborator = {"id": uuid.uuid4(), "name": "Test Collaborator"}
+        self.dao.insert("collaborator", collaborator)
+        studies = [{"name": "Study {}".format(i)} for i in range(3)]
+        self.dao.insert_many("sourcestudy", studies)
+        links = [
+            {"collaborator_id": collaborator["id"], "study_name": s["name"]}
+            for s in studies
+        ]
+        self.dao.insert("sourcestudycollaborator", links[0])
+        for _ in range(2):
+            mismatches = self.dao.insert_or_check_identical_many(
+                "sourcestudycollaborator", links
+            )
+            self.assertEqual(mismatches, [])
+        rows = list(self.dao.query(self.dao.sourcestudycollaborator.select()))
+        self.assertEqual(len(rows), 3)
+
+    def test_items_with_different_keys(self):
+        people = [
+            {"id": uuid.uuid4()},
+            {"id": uuid.uuid4(), "sex": "other", "year_of_birth": 1970},
+            {"id": uuid.uuid4(), "sex": "female"},
+        ]
+        for _ in range(2):
+            mismatches = self.dao.insert_or_check_identical_many(
+                "person", people
+            )
+            self.assertEqual(mismatches, [])
+        stored = {
+            row.id: (row.sex, row.year_of_birth)
+            for row in self.dao.query(self.dao.person.select())
+        }
+        self.assertEqual(
+            stored,
+            {
+                people[0]["id"]: (None, None),
+                people[1]["id"]: ("other", 1970),
+                people[2]["id"]: ("female", None),
+            },
+        )
+
+
 class TestDaoOperations(unittest.TestCase):
     """Verify that saving, loading, and querying work as expected"""
 
@@ -1,5 +1,7 @@
 import unittest
 
+import shared_schema.data as data
+import shared_schema.datatypes as datatypes
 import shared_schema.tables as tables
 import test.example_data
 
@@ -24,6 +26,37 @@ class TestSchema(unittest.TestCase):
             "Relationships not as expected",
         )
 
+    def test_indexes(self):
+        sd = tables.Schema(test.example_data.entities)
+        self.assertEqual(
+            set(sd.fields),
+            {("foo", "foo1"), ("bar", "bar1"), ("bar", "bar2"),
+             ("baz", "baz1")},
+        )
+        self.assertEqual(
+            sd.datatypes[("baz", "baz1")], datatypes.Datatype.FOREIGN_KEY
+        )
+        self.assertEqual(
+            sd.datatypes[("bar", "bar2")], datatypes.Datatype.DATE
+        )
+        fk = tables.ForeignKey(source="baz", field="baz1", target="foo")
+        self.assertEqual(sd.foreign_keys, (fk,))
+        self.assertEqual(dict(sd.references), {"foo": (fk,)})
+        with self.assertRaises(TypeError):
+            sd.fields[("foo", "foo2")] = None
+
+    def test_references(self):
+        referrers = {
+            (fk.source, fk.field)
+            for fk in data.schema_data.references["Case"]
+        }
+        self.assertIn(("ClinicalIsolate", "case_id"), referrers)
+        self.assertIn(("TreatmentData", "case_id"), referrers)
+        self.assertEqual(
+            len(data.schema_data.foreign_keys),
+            sum(len(fks) for fks in data.schema_data.references.values()),
+        )
+
     def test_find_field(self):
         sd = tables.Schema(test.example_data.entities)
 
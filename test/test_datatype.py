@@ -47,3 +47,31 @@ class TestClassify(unittest.TestCase):
         for src in error_cases:
             with self.assertRaises(ValueError):
                 datatypes.classify(src)
+
+
+class TestParse(unittest.TestCase):
+
+    def test_atomic_types(self):
+        parsed = datatypes.parse('Integer ')
+        self.assertEqual(parsed, (Datatype.INTEGER, None, None))
+
+    def test_enum(self):
+        parsed = datatypes.parse('enum(Asdf, jkl,semicolon)')
+        self.assertIs(parsed.datatype, Datatype.ENUM)
+        self.assertEqual(parsed.members, ('asdf', 'jkl', 'semicolon'))
+        self.assertIsNone(parsed.target)
+
+    def test_foreign_key(self):
+        parsed = datatypes.parse('foreign key(Asdf Jkl)')
+        self.assertIs(parsed.datatype, Datatype.FOREIGN_KEY)
+        self.assertEqual(parsed.target, 'Asdf Jkl')
+        self.assertIsNone(parsed.members)
+
+    def test_cached(self):
+        src = 'enum(a, b, c)'
+        self.assertIs(datatypes.parse(src), datatypes.parse(src))
+
+    def test_failure_cases(self):
+        for src in [object(), None, ['integer'], 'non-existant type']:
+            with self.assertRaises(ValueError):
+                datatypes.parse(src)
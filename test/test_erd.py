@@ -0,0 +1,16 @@
+import unittest
+
+from shared_schema import tables
+from shared_schema.export import erd
+
+
+class TestFieldDefinitions(unittest.TestCase):
+    def test_foreign_keys_are_marked(self):
+        cases = [
+            ("foreign key (Foo)", {"tags": {"required"}}, " *foo_id*"),
+            ("enum(foreign key, other)", None, "  foo_id"),
+            ("string", None, "  foo_id"),
+        ]
+        for field_type, meta, expected in cases:
+            fld = tables.Field.make("foo_id", field_type, "A field", meta)
+            self.assertEqual(erd.field_def(fld), expected)
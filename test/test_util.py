@@ -25,3 +25,14 @@ class TestFunctions(unittest.TestCase):
                 expected,
                 list(util.enum_members(input)),
             )
+
+    def test_chunks(self):
+        cases = [
+            (range(5), 2, [[0, 1], [2, 3], [4]]),
+            (range(4), 2, [[0, 1], [2, 3]]),
+            ([], 3, []),
+        ]
+        for (items, size, expected) in cases:
+            self.assertEqual(expected, list(util.chunks(iter(items), size)))
+        with self.assertRaises(ValueError):
+            list(util.chunks([1], 0))
@@ -0,0 +1,164 @@
+import datetime
+import decimal
+import unittest
+import uuid
+
+import shared_schema.data as data
+import shared_schema.tables as tables
+import shared_schema.validation as validation
+import test.example_data
+
+
+class TestCoercer(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = tables.Schema(test.example_data.entities)
+
+    def coerce(self, field_type, value):
+        coerce, _ = validation.coercer(self.schema, field_type)
+        return coerce(value)
+
+    def test_strings_are_coerced(self):
+        uid = uuid.uuid4()
+        cases = [
+            ("integer", "12", 12),
+            ("float", "1.5", decimal.Decimal("1.5")),
+            ("string", " x ", " x "),
+            ("date", "2019-01-02", datetime.date(2019, 1, 2)),
+            ("uuid", str(uid), uid),
+            ("bool", "False", False),
+            ("enum(a, b)", " B", "b"),
+            ("foreign key(foo)", "3", 3),
+        ]
+        for field_type, value, expected in cases:
+            self.assertEqual(self.coerce(field_type, value), expected)
+
+    def test_typed_values_pass(self):
+        uid = uuid.uuid4()
+        cases = [
+            ("integer", 12),
+            ("float", 1.5),
+            ("date", datetime.date(2019, 1, 2)),
+            ("uuid", uid),
+            ("bool", True),
+            ("enum(a, b)", "a"),
+        ]
+        for field_type, value in cases:
+            self.assertIs(self.coerce(field_type, value), value)
+
+    def test_invalid_values(self):
+        cases = [
+            ("integer", "1.5"),
+            ("integer", True),
+            ("float", "nan"),
+            ("float", "1.2.3"),
+            ("string", 12),
+            ("date", "2019-13-01"),
+            ("date", "20190102"),
+            ("date", "2019-W01-2"),
+            ("uuid", "not a uuid"),
+            ("bool", "maybe"),
+            ("enum(a, b)", "c"),
+        ]
+        for field_type, value in cases:
+            with self.assertRaises(ValueError):
+                self.coerce(field_type, value)
+
+
+class TestEntityValidator(unittest.TestCase):
+
+    def test_valid_rows_are_coerced(self):
+        validator = data.schema_data.validator("Person")
+        uid = uuid.uuid4()
+        rows = [
+            {"id": str(uid), "sex": "Female", "year_of_birth": "1970"},
+            {"id": uid, "ethnicity": "", "year_of_birth": None},
+        ]
+        result = validator(rows)
+        self.assertEqual(result.errors, [])
+        self.assertEqual(
+            result.rows,
+            [
+                {"id": uid, "sex": "female", "year_of_birth": 1970},
+                {"id": uid, "ethnicity": None, "year_of_birth": None},
+            ],
+        )
+
+    def test_every_error_is_reported(self):
+        validator = data.schema_data.validator("Case")
+        rows = [
+            {"id": str(uuid.uuid4()), "person_id": str(uuid.uuid4())},
+            {"id": "bad", "country": 7, "colour": "red"},
+            "not a row",
+        ]
+        result = validator(rows, start=10)
+        self.assertEqual(len(result.rows), 1)
+        found = {(err.row, err.field) for err in result.errors}
+        self.assertEqual(
+            found,
+            {
+                (11, "id"),
+                (11, "country"),
+                (11, "colour"),
+                (11, "person_id"),
+                (12, None),
+            },
+        )
+        missing = [err for err in result.errors if err.field == "person_id"]
+        self.assertEqual(missing[0].message, "Required")
+
+    def test_constraints_are_checked(self):
+        validator = data.schema_data.validator("Substitution")
+        sub = {"alignment_id": str(uuid.uuid4()), "position": "12"}
+        rows = [
+            dict(sub, kind="simple", sub_aa="h"),
+            dict(sub, kind="deletion", deletion_length="2"),
+            dict(sub, kind="simple", insertion="AA", deletion_length="2"),
+            dict(sub, kind="insertion"),
+            dict(sub, kind="bad", insertion="AA"),
+        ]
+        result = validator(rows)
+        self.assertEqual(len(result.rows), 2)
+        found = [(err.row, err.field, err.message) for err in result.errors]
+        self.assertEqual(
+            found,
+            [
+                (2, None, "Violates constraint content_matches_kind"),
+                (3, None, "Violates constraint content_matches_kind"),
+                (4, "kind", "Expected one of: simple, insertion, deletion"),
+            ],
+        )
+
+    def test_unchecked_constraints_are_reported(self):
+        entity = tables.Entity.make(
+            "Checked",
+            "An entity with a constraint but no row check",
+            [tables.Field.make("a", "integer", "Test field 'a'")],
+            meta={"primary key": "a", "constraints": {"positive": "a > 0"}},
+        )
+        validator = tables.Schema([entity]).validator("Checked")
+        result = validator([{"a": "1"}])
+        self.assertEqual(result.rows, [])
+        self.assertEqual(
+            [err.message for err in result.errors],
+            ["Can't check constraint positive"],
+        )
+        with self.assertRaises(UserWarning):
+            tables.Entity.make(
+                "Checked",
+                "An entity with a row check but no constraint",
+                [tables.Field.make("a", "integer", "Test field 'a'")],
+                meta={"primary key": "a", "row checks": {"positive": bool}},
+            )
+
+    def test_validators_are_cached(self):
+        self.assertIs(
+            data.schema_data.validator("Case"),
+            data.schema_data.validator("Case"),
+        )
+        with self.assertRaises(KeyError):
+            data.schema_data.validator("NoSuchEntity")
+
+    def test_every_entity_compiles(self):
+        for name in data.schema_data.entities:
+            data.schema_data.validator(name)